@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+loadtest.py
+
+Load generator for the Voicelogger web service. Virtual users upload synthetic
+WAV files to ``/upload``, poll ``/jobs/{id}`` until the job finishes and fetch
+every result through ``/download``. Concurrency is ramped through a list of
+stages; for each stage the harness reports request latency percentiles per
+endpoint, job completion throughput, queue wait time and the resident memory
+of the server and worker processes.
+
+By default the harness starts its own server (uvicorn) and workers against a
+temporary data directory with ``VOICELOGGER_STUB_TRANSCRIBER`` set, so jobs take
+``duration * --stub-rtf`` seconds without loading a model. ``--backend`` runs
+the workers with a real transcription backend instead (e.g. to compare
+faster-whisper and whisper.cpp throughput and memory on the same host), and
+``--url`` targets a service that is already running.
+
+Requires ``httpx`` (``pip install httpx``)::
+
+    python bench/loadtest.py --stages 1,4,16 --sizes 10,60 --stage-seconds 30
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import wave
+from typing import Dict, List, Optional
+
+try:
+    import httpx  # type: ignore
+except ImportError:
+    httpx = None  # type: ignore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def synthetic_wav(seconds: float, sampling_rate: int = 16000) -> bytes:
+    """Return a mono 16-bit WAV of ``seconds`` of noise."""
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sampling_rate)
+        w.writeframes(os.urandom(int(seconds * sampling_rate) * 2))
+    return buf.getvalue()
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def _descendants(pid: int) -> List[int]:
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", "r") as f:
+            for child in f.read().split():
+                pids += _descendants(int(child))
+    except OSError:
+        pass
+    return pids
+
+
+def rss_kib(pid: int) -> int:
+    """Resident set size of ``pid`` and all its descendants in KiB (Linux /proc).
+
+    Descendants include e.g. whisper.cpp server processes started by workers.
+    """
+    total = 0
+    for p in _descendants(pid):
+        try:
+            with open(f"/proc/{p}/status", "r") as f:
+                m = re.search(r"^VmRSS:\s+(\d+)", f.read(), re.MULTILINE)
+                total += int(m.group(1)) if m else 0
+        except OSError:
+            pass
+    return total
+
+
+class Stats:
+    """Measurements collected during one concurrency stage."""
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.latency: Dict[str, List[float]] = {"upload": [], "status": [], "download": []}
+        self.errors: Dict[str, int] = {}
+        self.completed = 0
+        self.failed = 0
+        self.queue_wait: List[float] = []
+        self.turnaround: List[float] = []
+        self.rss: List[Dict[str, float]] = []
+        self.started = time.monotonic()
+        self.ended: Optional[float] = None
+
+    def error(self, kind: str) -> None:
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def summary(self) -> Dict[str, object]:
+        elapsed = (self.ended or time.monotonic()) - self.started
+        lat = {
+            name: {
+                "count": len(v),
+                "p50_ms": _ms(percentile(v, 50)),
+                "p90_ms": _ms(percentile(v, 90)),
+                "p99_ms": _ms(percentile(v, 99)),
+                "max_ms": _ms(max(v) if v else None),
+            }
+            for name, v in self.latency.items()
+        }
+        return {
+            "concurrency": self.concurrency,
+            "seconds": round(elapsed, 1),
+            "jobs_completed": self.completed,
+            "jobs_failed": self.failed,
+            "jobs_per_minute": round(self.completed * 60 / elapsed, 2) if elapsed else 0.0,
+            "latency": lat,
+            "queue_wait_s": {
+                "mean": _round(statistics.fmean(self.queue_wait) if self.queue_wait else None),
+                "p90": _round(percentile(self.queue_wait, 90)),
+                "max": _round(max(self.queue_wait) if self.queue_wait else None),
+            },
+            "turnaround_s_p90": _round(percentile(self.turnaround, 90)),
+            "rss_mib_max": {
+                k: round(max(s[k] for s in self.rss) / 1024, 1) for k in ("server", "workers") if self.rss
+            },
+            "rss_timeline": self.rss,
+            "errors": self.errors,
+        }
+
+
+def _ms(v: Optional[float]) -> Optional[float]:
+    return round(v * 1000, 1) if v is not None else None
+
+
+def _round(v: Optional[float]) -> Optional[float]:
+    return round(v, 2) if v is not None else None
+
+
+async def run_job(client: "httpx.AsyncClient", audio: bytes, name: str, stats: Stats, args: argparse.Namespace) -> None:
+    """Upload one file, wait for its job and download every result."""
+    t0 = time.perf_counter()
+    try:
+        r = await client.post(
+            "/upload",
+            files={"file": (name, audio, "audio/wav")},
+            data={"model": args.model, "language": "th"},
+        )
+    except httpx.HTTPError:
+        stats.error("upload")
+        return
+    stats.latency["upload"].append(time.perf_counter() - t0)
+    if r.status_code != 303:
+        stats.error(f"upload_{r.status_code}")
+        return
+    job_url = r.headers["location"]
+
+    deadline = time.monotonic() + args.job_timeout
+    job: Dict[str, object] = {}
+    while time.monotonic() < deadline:
+        t0 = time.perf_counter()
+        try:
+            r = await client.get(job_url, headers={"accept": "application/json"})
+        except httpx.HTTPError:
+            stats.error("status")
+            await asyncio.sleep(args.poll_interval)
+            continue
+        stats.latency["status"].append(time.perf_counter() - t0)
+        job = r.json()
+        if job.get("status") in ("done", "error"):
+            break
+        await asyncio.sleep(args.poll_interval)
+    else:
+        stats.error("job_timeout")
+        return
+
+    if job["status"] == "error":
+        stats.failed += 1
+        return
+    stats.completed += 1
+    if job.get("started_at"):
+        stats.queue_wait.append(float(job["started_at"]) - float(job["created_at"]))
+    if job.get("finished_at"):
+        stats.turnaround.append(float(job["finished_at"]) - float(job["created_at"]))
+
+    for fname in job.get("files", []):
+        t0 = time.perf_counter()
+        try:
+            r = await client.get(f"/download/{job['id']}/{fname}")
+        except httpx.HTTPError:
+            stats.error("download")
+            continue
+        stats.latency["download"].append(time.perf_counter() - t0)
+        if r.status_code != 200:
+            stats.error(f"download_{r.status_code}")
+
+
+async def virtual_user(client, clips: Dict[float, bytes], stats: Stats, stop_at: float, args) -> None:
+    while time.monotonic() < stop_at:
+        seconds = random.choice(list(clips))
+        await run_job(client, clips[seconds], f"load_{seconds:g}s_{uuid.uuid4().hex[:8]}.wav", stats, args)
+
+
+async def sample_rss(stats: Stats, server_pid: Optional[int], worker_pid: Optional[int], done: asyncio.Event) -> None:
+    while not done.is_set():
+        stats.rss.append(
+            {
+                "t": round(time.monotonic() - stats.started, 1),
+                "server": rss_kib(server_pid) if server_pid else 0,
+                "workers": rss_kib(worker_pid) if worker_pid else 0,
+            }
+        )
+        try:
+            await asyncio.wait_for(done.wait(), timeout=1.0)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_stages(args: argparse.Namespace, server_pid: Optional[int], worker_pid: Optional[int]) -> List[Dict]:
+    clips = {s: synthetic_wav(s) for s in args.sizes}
+    results = []
+    limits = httpx.Limits(max_connections=max(args.stages) * 2)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.request_timeout, limits=limits) as client:
+        for concurrency in args.stages:
+            stats = Stats(concurrency)
+            done = asyncio.Event()
+            sampler = asyncio.create_task(sample_rss(stats, server_pid, worker_pid, done))
+            stop_at = time.monotonic() + args.stage_seconds
+            await asyncio.gather(*(virtual_user(client, clips, stats, stop_at, args) for _ in range(concurrency)))
+            stats.ended = time.monotonic()
+            done.set()
+            await sampler
+            summary = stats.summary()
+            results.append(summary)
+            print_stage(summary)
+    return results
+
+
+def print_stage(s: Dict) -> None:
+    lat = s["latency"]
+    print(
+        f"c={s['concurrency']:<4} jobs/min={s['jobs_per_minute']:<8} done={s['jobs_completed']:<5} "
+        f"failed={s['jobs_failed']:<3} upload p50/p99={lat['upload']['p50_ms']}/{lat['upload']['p99_ms']} ms  "
+        f"status p99={lat['status']['p99_ms']} ms  queue wait p90={s['queue_wait_s']['p90']} s  "
+        f"rss max={s['rss_mib_max']} MiB  errors={s['errors'] or '-'}"
+    )
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_service(args: argparse.Namespace) -> List[subprocess.Popen]:
+    """Start uvicorn and the workers with a stub transcriber; return [server, workers]."""
+    data_dir = args.data_dir = tempfile.mkdtemp(prefix="voicelogger_load_")
+    env = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        VOICELOGGER_DATA_DIR=data_dir,
+        VOICELOGGER_POLL_INTERVAL="0.2",
+    )
+    if args.backend:
+        env["VOICELOGGER_BACKEND"] = args.backend
+        env.pop("VOICELOGGER_STUB_TRANSCRIBER", None)
+    else:
+        env["VOICELOGGER_STUB_TRANSCRIBER"] = str(args.stub_rtf)
+    port = _free_port()
+    args.url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "webapp.app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+        env=env,
+    )
+    workers = subprocess.Popen(
+        [sys.executable, "-m", "webapp.worker", "--processes", str(args.workers)],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                break
+        except OSError:
+            time.sleep(0.1)
+    print(f"Started server pid={server.pid} and {args.workers} worker(s) on {args.url} (data: {data_dir})")
+    return [server, workers]
+
+
+def build_parser() -> argparse.ArgumentParser:
+    ints = lambda v: [int(x) for x in v.split(",") if x.strip()]
+    floats = lambda v: [float(x) for x in v.split(",") if x.strip()]
+    parser = argparse.ArgumentParser(description="Load-test the Voicelogger web service.")
+    parser.add_argument("--url", help="Target an already running service instead of starting one")
+    parser.add_argument("--server-pid", type=int, help="PID to sample RSS from when using --url")
+    parser.add_argument("--stages", type=ints, default=[1, 2, 4, 8, 16], help="Concurrency per stage (default: 1,2,4,8,16)")
+    parser.add_argument("--stage-seconds", type=float, default=30.0, help="Duration of each stage (default: 30)")
+    parser.add_argument("--sizes", type=floats, default=[10.0, 60.0], help="Synthetic audio lengths in seconds (default: 10,60)")
+    parser.add_argument("--model", default="small", help="Model name sent with each upload (default: small)")
+    parser.add_argument("--workers", type=int, default=2, help="Worker processes to start (default: 2)")
+    parser.add_argument("--backend", help="Run workers with this transcription backend instead of the stub")
+    parser.add_argument("--stub-rtf", type=float, default=0.05, help="Simulated real-time factor (default: 0.05)")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="Job status poll interval (default: 0.5)")
+    parser.add_argument("--job-timeout", type=float, default=600.0, help="Give up on a job after this many seconds")
+    parser.add_argument("--request-timeout", type=float, default=60.0, help="HTTP request timeout in seconds")
+    parser.add_argument("--keep-data", action="store_true", help="Keep the temporary data directory of a started service")
+    parser.add_argument("--output", help="Write the full results (including RSS timelines) as JSON")
+    return parser
+
+
+def main(argv: List[str] | None = None) -> None:
+    args = build_parser().parse_args(argv)
+    if httpx is None:
+        print("httpx is not installed. Install it via `pip install httpx`.", file=sys.stderr)
+        sys.exit(1)
+    procs: List[subprocess.Popen] = []
+    server_pid, worker_pid = args.server_pid, None
+    if not args.url:
+        procs = start_service(args)
+        server_pid, worker_pid = procs[0].pid, procs[1].pid
+    try:
+        results = asyncio.run(run_stages(args, server_pid, worker_pid))
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait(timeout=30)
+        if procs and not args.keep_data:
+            shutil.rmtree(args.data_dir, ignore_errors=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items()}, "stages": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
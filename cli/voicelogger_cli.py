@@ -13,25 +13,32 @@ modules implemented in the `core` package.
 """
 
 import argparse
+import json
 import os
 import sys
 from typing import List
 
 # Import core modules
 try:
-    from core.transcribe import transcribe_to_segments, segments_to_text
+    from core.transcribe import prepare_audio, transcribe_to_segments, segments_to_text
+    from core.stages import Stage, StageGraph
     from core.exporters import export_txt, export_srt, export_vtt, export_json
     from core.summary import simple_summary
     from core.report import generate_markdown_report
     from core.crypto import encrypt_file_aes_gcm
+    from core import tuning
+    from core.routing import route_and_transcribe
 except ImportError as e:
     # If running from source repository, adjust sys.path to include project root
     sys.path.append(os.path.dirname(os.path.dirname(__file__)))  # add project root
-    from core.transcribe import transcribe_to_segments, segments_to_text
+    from core.transcribe import prepare_audio, transcribe_to_segments, segments_to_text
+    from core.stages import Stage, StageGraph
     from core.exporters import export_txt, export_srt, export_vtt, export_json
     from core.summary import simple_summary
     from core.report import generate_markdown_report
     from core.crypto import encrypt_file_aes_gcm
+    from core import tuning
+    from core.routing import route_and_transcribe
 
 
 def find_audio_files(input_path: str) -> List[str]:
@@ -54,11 +61,47 @@ def find_audio_files(input_path: str) -> List[str]:
         return [input_path]
 
 
-def process_audio_file(audio_path: str, outdir: str, args: argparse.Namespace) -> None:
-    """Process a single audio file: transcribe, export, summarize, report, encrypt."""
-    base_name = os.path.splitext(os.path.basename(audio_path))[0]
+def _decode_stage(item: dict, args: argparse.Namespace) -> None:
+    item["audio"] = prepare_audio(
+        item["path"], backend=args.backend, waveform=bool(args.route or args.diarize)
+    )
+
+
+def _transcribe_stage(item: dict, args: argparse.Namespace) -> None:
+    audio_path = item["path"]
+    audio = item.pop("audio", audio_path)
     print(f"Transcribing {audio_path} ...")
-    segments = transcribe_to_segments(audio_path, model_size=args.model, language=args.language)
+    if args.route:
+        item["segments"], decision = route_and_transcribe(
+            audio,
+            model_size=args.model,
+            language=args.language,
+            diarize=args.diarize,
+            max_speakers=args.max_speakers,
+            backend=args.backend,
+        )
+        item["log"].append(
+            f"  -> Routing: {decision['action']} ({decision['model'] or 'no model'}): {decision['reason']}"
+        )
+    else:
+        item["segments"] = transcribe_to_segments(
+            audio,
+            model_size=args.model,
+            language=args.language,
+            diarize=args.diarize,
+            max_speakers=args.max_speakers,
+            backend=args.backend,
+        )
+
+
+def _write(path: str, content: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def _export_stage(item: dict, args: argparse.Namespace) -> None:
+    audio_path, outdir, segments, log = item["path"], item["outdir"], item["segments"], item["log"]
+    base_name = os.path.splitext(os.path.basename(audio_path))[0]
 
     # Ensure output directory exists
     os.makedirs(outdir, exist_ok=True)
@@ -68,20 +111,20 @@ def process_audio_file(audio_path: str, outdir: str, args: argparse.Namespace) -
     # If no specific export flag is provided, default to TXT
     if args.txt or not any_flag:
         txt_path = os.path.join(outdir, f"{base_name}.txt")
-        export_txt(segments, txt_path)
-        print(f"  -> TXT saved to {txt_path}")
+        _write(txt_path, export_txt(segments))
+        log.append(f"  -> TXT saved to {txt_path}")
     if args.srt:
         srt_path = os.path.join(outdir, f"{base_name}.srt")
-        export_srt(segments, srt_path)
-        print(f"  -> SRT saved to {srt_path}")
+        _write(srt_path, export_srt(segments))
+        log.append(f"  -> SRT saved to {srt_path}")
     if args.vtt:
         vtt_path = os.path.join(outdir, f"{base_name}.vtt")
-        export_vtt(segments, vtt_path)
-        print(f"  -> VTT saved to {vtt_path}")
+        _write(vtt_path, export_vtt(segments))
+        log.append(f"  -> VTT saved to {vtt_path}")
     if args.json:
         json_path = os.path.join(outdir, f"{base_name}.json")
-        export_json(segments, json_path)
-        print(f"  -> JSON saved to {json_path}")
+        _write(json_path, export_json(segments))
+        log.append(f"  -> JSON saved to {json_path}")
 
     # Compose full transcript text
     transcript_text = segments_to_text(segments)
@@ -92,21 +135,51 @@ def process_audio_file(audio_path: str, outdir: str, args: argparse.Namespace) -
         max_sentences = args.summary_length or 5
         summary_text = simple_summary(transcript_text, max_sentences=max_sentences)
         summary_path = os.path.join(outdir, f"{base_name}.summary.txt")
-        with open(summary_path, "w", encoding="utf-8") as f:
-            f.write(summary_text)
-        print(f"  -> Summary saved to {summary_path}")
+        _write(summary_path, summary_text)
+        log.append(f"  -> Summary saved to {summary_path}")
 
     # Generate report (always)
     report_path = os.path.join(outdir, f"{base_name}_report.md")
-    generate_markdown_report(transcript_text, summary_text, report_path, os.path.basename(audio_path))
-    print(f"  -> Report saved to {report_path}")
+    _write(report_path, generate_markdown_report(transcript_text, summary_text, os.path.basename(audio_path)))
+    log.append(f"  -> Report saved to {report_path}")
+
+
+def _encrypt_stage(item: dict, args: argparse.Namespace) -> None:
+    # Needs only the original file, so it runs alongside transcription.
+    if not args.passphrase:
+        return
+    audio_path, outdir = item["path"], item["outdir"]
+    base_name = os.path.splitext(os.path.basename(audio_path))[0]
+    os.makedirs(outdir, exist_ok=True)
+    enc_path = os.path.join(outdir, f"{base_name}.enc")
+    meta = encrypt_file_aes_gcm(audio_path, enc_path, args.passphrase)
+    _write(f"{enc_path}.meta.json", json.dumps(meta, indent=2))
+    item["log"].append(f"  -> Encrypted audio saved to {enc_path} and metadata")
+
 
-    # Encrypt original audio file if passphrase provided
-    if args.passphrase:
-        enc_path = os.path.join(outdir, f"{base_name}.enc")
-        encrypt_file_aes_gcm(audio_path, enc_path, args.passphrase)
-        print(f"  -> Encrypted audio saved to {enc_path} and metadata")
+def build_stages(args: argparse.Namespace) -> List[Stage]:
+    """Stages for one input file, run by :class:`core.stages.StageGraph`.
 
+    The next file is decoded and the previous one exported and encrypted on
+    separate threads while the model transcribes the current file.
+    """
+    return [
+        Stage("decode", lambda item: _decode_stage(item, args)),
+        Stage("transcribe", lambda item: _transcribe_stage(item, args), after=("decode",)),
+        Stage(
+            "export", lambda item: _export_stage(item, args), after=("transcribe",),
+            workers=args.io_workers, capacity=args.io_workers,
+        ),
+        Stage("encrypt", lambda item: _encrypt_stage(item, args), workers=args.io_workers),
+    ]
+
+
+def process_audio_file(audio_path: str, outdir: str, args: argparse.Namespace) -> None:
+    """Process a single audio file: transcribe, export, summarize, report, encrypt."""
+    item = {"path": audio_path, "outdir": outdir, "log": []}
+    for stage in build_stages(args):
+        stage.fn(item)
+    print("\n".join(item["log"]))
 
 
 def build_parser() -> argparse.ArgumentParser:
@@ -134,6 +207,11 @@ def build_parser() -> argparse.ArgumentParser:
         default="th",
         help="Language code for transcription (default: th)",
     )
+    parser.add_argument(
+        "--backend",
+        help="Transcription backend: faster-whisper or whisper.cpp "
+        "(default: $VOICELOGGER_BACKEND or faster-whisper)",
+    )
 
     # Output format flags
     parser.add_argument("--txt", action="store_true", help="Export plain text transcript")
@@ -141,6 +219,23 @@ def build_parser() -> argparse.ArgumentParser:
     parser.add_argument("--vtt", action="store_true", help="Export VTT subtitles")
     parser.add_argument("--json", action="store_true", help="Export JSON with timestamps")
 
+    parser.add_argument(
+        "--diarize",
+        action="store_true",
+        help="Label transcript segments with speakers",
+    )
+    parser.add_argument(
+        "--max-speakers",
+        type=int,
+        default=8,
+        help="Maximum number of speakers when diarizing (default: 8)",
+    )
+    parser.add_argument(
+        "--route",
+        action="store_true",
+        help="Pick the model per file: skip silent files, use a small model for short clips "
+        "and escalate to a larger one when confidence is low",
+    )
     parser.add_argument(
         "--summary",
         action="store_true",
@@ -156,10 +251,111 @@ def build_parser() -> argparse.ArgumentParser:
         "--passphrase",
         help="Passphrase for AES-GCM encryption of the original audio file",
     )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=1,
+        help="Files to decode ahead of the one being transcribed (default: 1)",
+    )
+    parser.add_argument(
+        "--io-workers",
+        type=int,
+        default=2,
+        help="Threads for exporting and encrypting finished files (default: 2)",
+    )
     return parser
 
 
+def _csv(value: str) -> List[str]:
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def build_tune_parser() -> argparse.ArgumentParser:
+    """Configure and return the argument parser for ``voicelogger_cli.py tune``."""
+    parser = argparse.ArgumentParser(
+        prog="voicelogger_cli.py tune",
+        description="Benchmark transcription settings on this host and save the fastest as its profile.",
+    )
+    parser.add_argument("--clip", required=True, help="Short reference audio clip (30-60 seconds)")
+    parser.add_argument("--model", default="medium", help="Whisper model size to tune (default: medium)")
+    parser.add_argument("--language", default="th", help="Language code of the clip (default: th)")
+    parser.add_argument(
+        "--compute-types",
+        type=_csv,
+        default=list(tuning.DEFAULT_COMPUTE_TYPES),
+        help="Comma-separated compute types (default: int8,int8_float32,float32)",
+    )
+    parser.add_argument(
+        "--threads",
+        type=lambda v: [int(x) for x in _csv(v)],
+        help="Comma-separated cpu_threads values (default: all, half and a quarter of the cores)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=lambda v: [int(x) for x in _csv(v)],
+        default=[1],
+        help="Comma-separated num_workers values (default: 1)",
+    )
+    parser.add_argument(
+        "--beam-sizes",
+        type=lambda v: [int(x) for x in _csv(v)],
+        default=[1, 5],
+        help="Comma-separated beam sizes (default: 1,5)",
+    )
+    parser.add_argument(
+        "--max-drift",
+        type=float,
+        default=0.03,
+        help="Largest character error rate against the float32 baseline to accept (default: 0.03)",
+    )
+    parser.add_argument("--profile", help="Profile path (default: $VOICELOGGER_PROFILE or ~/.config/voicelogger/profile.json)")
+    parser.add_argument("--dry-run", action="store_true", help="Report results without saving the profile")
+    return parser
+
+
+def tune_main(argv: List[str]) -> None:
+    args = build_tune_parser().parse_args(argv)
+    if not os.path.isfile(args.clip):
+        print(f"Reference clip not found: {args.clip}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.threads:
+        layouts = [(t, w) for t in args.threads for w in args.workers]
+    else:
+        layouts = [(t, w) for t, _ in tuning.default_thread_layouts() for w in args.workers]
+
+    print(f"{'compute_type':<14}{'threads':>8}{'workers':>8}{'beam':>6}{'RTF':>8}{'drift':>8}")
+
+    def report(r: dict) -> None:
+        print(
+            f"{r['compute_type']:<14}{r['cpu_threads']:>8}{r['num_workers']:>8}"
+            f"{r['beam_size']:>6}{r['rtf']:>8.3f}{r['drift']:>8.3f}"
+        )
+
+    results = tuning.benchmark(
+        args.clip,
+        model_size=args.model,
+        language=args.language,
+        compute_types=args.compute_types,
+        thread_layouts=layouts,
+        beam_sizes=args.beam_sizes,
+        progress=report,
+    )
+    best = tuning.pick_best(results, max_drift=args.max_drift)
+    print("\nBest:", end=" ")
+    report(best)
+    if args.dry_run:
+        return
+    path = tuning.update_profile(args.model, best, args.clip, path=args.profile)
+    print(f"Profile saved to {path}")
+
+
 def main(argv: List[str] | None = None) -> None:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "tune":
+        tune_main(argv[1:])
+        return
+
     parser = build_parser()
     args = parser.parse_args(argv)
 
@@ -169,9 +365,22 @@ def main(argv: List[str] | None = None) -> None:
         print(f"No supported audio files found at {args.input}", file=sys.stderr)
         sys.exit(1)
 
-    for audio_file in audio_files:
-        process_audio_file(audio_file, args.outdir, args)
+    # Pipeline the files: decode ahead, export and encrypt behind the model.
+    # Only decode and transcribe count against max_in_flight, so at most
+    # --prefetch files are decoded ahead of the one being transcribed.
+    graph = StageGraph(build_stages(args), max_in_flight=1 + args.prefetch, release_after="transcribe")
+    items = ({"path": f, "outdir": args.outdir, "log": []} for f in audio_files)
+    failed = 0
+    for item in graph.run(items):
+        if item["log"]:
+            print("\n".join(item["log"]))
+        if "error" in item:
+            failed += 1
+            print(f"  !! {item['path']}: {item['error_stage']} failed: {item['error']}", file=sys.stderr)
 
+    if failed:
+        print(f"\n{failed} of {len(audio_files)} files failed.", file=sys.stderr)
+        sys.exit(1)
     print("\nAll files processed.")
 
 
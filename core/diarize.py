@@ -0,0 +1,242 @@
+"""
+Speaker diarization for Voicelogger.
+
+Labels transcript segments with speaker ids on CPU. Short windows inside each
+segment are turned into speaker embeddings in batches, and the embeddings are
+clustered online: every batch is compared against the current speaker
+centroids with a single matrix product, so memory grows with the number of
+speakers rather than with the length of the recording and multi-hour audio
+stays linear in time.
+
+The default embedder uses MFCC statistics and needs only numpy (installed with
+faster-whisper). Any callable that maps a batch of equal-length waveforms to
+embedding vectors can be passed instead, e.g. a wrapper around a neural
+speaker-verification model.
+"""
+
+from __future__ import annotations
+
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np  # type: ignore
+except ImportError:
+    np = None  # type: ignore
+
+SAMPLE_RATE = 16000
+
+Embedder = Callable[["np.ndarray"], "np.ndarray"]
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise ImportError("numpy is required for diarization. Install it via `pip install numpy`.")
+
+
+def load_audio(audio_path: str, sampling_rate: int = SAMPLE_RATE) -> "np.ndarray":
+    """Decode an audio file to a mono float32 waveform.
+
+    Raises:
+        ImportError: if faster-whisper (which provides the decoder) is not installed.
+    """
+    try:
+        from faster_whisper import decode_audio  # type: ignore
+    except ImportError as e:
+        raise ImportError(
+            "faster-whisper is not installed. Install it via `pip install faster-whisper`."
+        ) from e
+    return decode_audio(audio_path, sampling_rate=sampling_rate)
+
+
+def _mel_filterbank(n_fft: int, n_mels: int, sampling_rate: int) -> "np.ndarray":
+    def hz_to_mel(hz):
+        return 2595.0 * np.log10(1.0 + hz / 700.0)
+
+    def mel_to_hz(mel):
+        return 700.0 * (10.0 ** (mel / 2595.0) - 1.0)
+
+    mels = np.linspace(hz_to_mel(0.0), hz_to_mel(sampling_rate / 2), n_mels + 2)
+    bins = np.floor((n_fft + 1) * mel_to_hz(mels) / sampling_rate).astype(int)
+    fb = np.zeros((n_mels, n_fft // 2 + 1), dtype=np.float32)
+    for m in range(1, n_mels + 1):
+        left, centre, right = bins[m - 1], bins[m], bins[m + 1]
+        if centre > left:
+            fb[m - 1, left:centre] = (np.arange(left, centre) - left) / (centre - left)
+        if right > centre:
+            fb[m - 1, centre:right] = (right - np.arange(centre, right)) / (right - centre)
+    return fb
+
+
+class MfccEmbedder:
+    """Speaker embedding from the mean and spread of MFCCs over a window.
+
+    Works on a whole batch of windows at once: framing, FFT, mel projection
+    and DCT are each a single vectorised operation over the batch.
+    """
+
+    def __init__(self, sampling_rate: int = SAMPLE_RATE, n_mels: int = 40, n_mfcc: int = 20):
+        _require_numpy()
+        self.frame = int(0.025 * sampling_rate)
+        self.step = int(0.010 * sampling_rate)
+        self.n_fft = 1 << (self.frame - 1).bit_length()
+        self.window = np.hamming(self.frame).astype(np.float32)
+        self.fb = _mel_filterbank(self.n_fft, n_mels, sampling_rate)
+        k = np.arange(n_mels)
+        # DCT-II basis without c0, which mostly tracks loudness rather than voice.
+        self.dct = np.cos(np.pi / n_mels * (k[None, :] + 0.5) * np.arange(1, n_mfcc)[:, None]).astype(np.float32)
+
+    def __call__(self, windows: "np.ndarray") -> "np.ndarray":
+        n_frames = 1 + (windows.shape[1] - self.frame) // self.step
+        idx = np.arange(self.frame)[None, :] + self.step * np.arange(n_frames)[:, None]
+        frames = windows[:, idx] * self.window  # (batch, frames, frame_len)
+        power = np.abs(np.fft.rfft(frames, n=self.n_fft, axis=-1)) ** 2
+        logmel = np.log(power @ self.fb.T + 1e-10)
+        mfcc = logmel @ self.dct.T  # (batch, frames, n_mfcc - 1)
+        emb = np.concatenate([mfcc.mean(axis=1), mfcc.std(axis=1)], axis=1)
+        return emb.astype(np.float32)
+
+
+class OnlineSpeakerClustering:
+    """Incremental cosine clustering with at most ``max_speakers`` centroids.
+
+    Each embedding joins the most similar centroid if the similarity reaches
+    ``threshold``; otherwise it starts a new speaker while fewer than
+    ``max_speakers`` exist. Centroids are running means, so state is
+    ``O(max_speakers * dim)`` regardless of how much audio has been seen.
+    """
+
+    def __init__(self, threshold: float = 0.75, max_speakers: int = 8):
+        _require_numpy()
+        self.threshold = threshold
+        self.max_speakers = max_speakers
+        self.sums: Optional["np.ndarray"] = None
+        self.counts: Optional["np.ndarray"] = None
+
+    @property
+    def centroids(self) -> "np.ndarray":
+        c = self.sums / self.counts[:, None]
+        return c / np.maximum(np.linalg.norm(c, axis=1, keepdims=True), 1e-8)
+
+    def _add_speaker(self, emb: "np.ndarray") -> int:
+        if self.sums is None:
+            self.sums, self.counts = emb[None, :].copy(), np.ones(1)
+        else:
+            self.sums = np.vstack([self.sums, emb])
+            self.counts = np.append(self.counts, 1.0)
+        return len(self.counts) - 1
+
+    def partial_fit(self, embeddings: "np.ndarray") -> "np.ndarray":
+        """Assign a batch of embeddings to speakers and update the centroids.
+
+        Returns:
+            An integer label per embedding.
+        """
+        emb = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-8)
+        labels = np.full(len(emb), -1, dtype=int)
+        if self.sums is not None:
+            sims = emb @ self.centroids.T
+            best = sims.argmax(axis=1)
+            matched = sims[np.arange(len(emb)), best] >= self.threshold
+            labels[matched] = best[matched]
+            np.add.at(self.sums, labels[matched], emb[matched])
+            np.add.at(self.counts, labels[matched], 1.0)
+        # Only embeddings that match no existing speaker are handled one by one;
+        # in practice this is a handful of windows per new voice.
+        for i in np.flatnonzero(labels < 0):
+            if self.sums is not None:
+                sims = self.centroids @ emb[i]
+                j = int(sims.argmax())
+                if sims[j] >= self.threshold or len(self.counts) >= self.max_speakers:
+                    labels[i] = j
+                    self.sums[j] += emb[i]
+                    self.counts[j] += 1.0
+                    continue
+            labels[i] = self._add_speaker(emb[i])
+        return labels
+
+
+def _segment_windows(
+    segments: Sequence[Dict[str, float | str]], window: float, hop: float, min_window: float
+) -> Iterator[Tuple[int, float, float]]:
+    """Yield ``(segment index, start, end)`` for each analysis window inside the segments."""
+    for idx, seg in enumerate(segments):
+        start, end = float(seg.get("start", 0.0)), float(seg.get("end", 0.0))
+        if end - start < min_window:
+            continue
+        if end - start <= window:
+            # Centre a full-length window on short segments rather than zero-padding.
+            mid = (start + end) / 2
+            yield idx, max(0.0, mid - window / 2), max(0.0, mid - window / 2) + window
+            continue
+        t = start
+        while t + window <= end:
+            yield idx, t, t + window
+            t += hop
+
+
+def assign_speakers(
+    audio: "np.ndarray",
+    segments: List[Dict[str, float | str]],
+    embedder: Optional[Embedder] = None,
+    sampling_rate: int = SAMPLE_RATE,
+    window: float = 1.5,
+    hop: float = 0.75,
+    min_window: float = 0.4,
+    batch_size: int = 256,
+    threshold: float = 0.75,
+    max_speakers: int = 8,
+) -> List[Dict[str, float | str]]:
+    """Attach a ``"speaker"`` label to every segment.
+
+    Args:
+        audio: Mono waveform at ``sampling_rate`` (see :func:`load_audio`).
+        segments: Segments from :func:`core.transcribe.transcribe_to_segments`.
+        embedder: Callable mapping a ``(batch, samples)`` array to embeddings;
+            defaults to :class:`MfccEmbedder`.
+        sampling_rate: Sample rate of ``audio``.
+        window: Length in seconds of each analysis window.
+        hop: Step in seconds between windows within a segment.
+        min_window: Segments shorter than this are labelled from their neighbours.
+        batch_size: Number of windows embedded per batch.
+        threshold: Cosine similarity needed to join an existing speaker.
+        max_speakers: Upper bound on the number of speakers.
+
+    Returns:
+        The same segments (modified in place) with ``"speaker"`` set to
+        ``"SPEAKER_1"``, ``"SPEAKER_2"``, ... in order of first appearance.
+    """
+    _require_numpy()
+    embedder = embedder or MfccEmbedder(sampling_rate)
+    clustering = OnlineSpeakerClustering(threshold=threshold, max_speakers=max_speakers)
+    width = int(window * sampling_rate)
+    votes = np.zeros((len(segments), max_speakers), dtype=np.float32)
+
+    def flush(batch: List[Tuple[int, float, float]]) -> None:
+        buf = np.zeros((len(batch), width), dtype=np.float32)
+        for row, (_, start, end) in enumerate(batch):
+            chunk = audio[int(start * sampling_rate):int(end * sampling_rate)][:width]
+            buf[row, :len(chunk)] = chunk
+        labels = clustering.partial_fit(embedder(buf))
+        seg_idx = np.fromiter((b[0] for b in batch), dtype=int, count=len(batch))
+        weights = np.fromiter((b[2] - b[1] for b in batch), dtype=np.float32, count=len(batch))
+        np.add.at(votes, (seg_idx, labels), weights)
+
+    batch: List[Tuple[int, float, float]] = []
+    for item in _segment_windows(segments, window, hop, min_window):
+        batch.append(item)
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    # Number speakers by first appearance and fill unlabelled (very short)
+    # segments from the previous segment's speaker.
+    names: Dict[int, str] = {}
+    previous: Optional[str] = None
+    for idx, seg in enumerate(segments):
+        if votes[idx].any():
+            label = int(votes[idx].argmax())
+            previous = names.setdefault(label, f"SPEAKER_{len(names) + 1}")
+        seg["speaker"] = previous or "SPEAKER_1"
+    return segments
@@ -3,7 +3,8 @@ Export utilities for Voicelogger.
 
 Convert transcription segments to various output formats such as plain text,
 SRT, WebVTT, and JSON. These helpers operate on the list of segments
-returned from :func:`core.transcribe.transcribe_to_segments`.
+returned from :func:`core.transcribe.transcribe_to_segments`. Segments that carry
+a ``"speaker"`` label (see :mod:`core.diarize`) are rendered with it.
 """
 
 from __future__ import annotations
@@ -30,9 +31,15 @@ def _format_vtt_timestamp(seconds: float) -> str:
     return f"{hours:02}:{minutes:02}:{secs:02}.{milliseconds:03}"
 
 
+def _with_speaker(seg: Dict[str, float | str]) -> str:
+    """Return the segment text prefixed with ``"SPEAKER_n: "`` when it has a speaker."""
+    text = str(seg.get("text", "")).strip()
+    return f"{seg['speaker']}: {text}" if seg.get("speaker") else text
+
+
 def export_txt(segments: List[Dict[str, float | str]]) -> str:
     """Convert segments into a plain-text transcript separated by newlines."""
-    return "\n".join([str(seg.get("text", "")).strip() for seg in segments if seg.get("text")])
+    return "\n".join([_with_speaker(seg) for seg in segments if seg.get("text")])
 
 
 def export_srt(segments: List[Dict[str, float | str]]) -> str:
@@ -41,7 +48,7 @@ def export_srt(segments: List[Dict[str, float | str]]) -> str:
     for idx, seg in enumerate(segments, start=1):
         start = _format_srt_timestamp(float(seg.get("start", 0.0)))
         end = _format_srt_timestamp(float(seg.get("end", 0.0)))
-        text = str(seg.get("text", "")).strip()
+        text = _with_speaker(seg)
         lines.append(str(idx))
         lines.append(f"{start} --> {end}")
         lines.append(text)
@@ -56,6 +63,8 @@ def export_vtt(segments: List[Dict[str, float | str]]) -> str:
         start = _format_vtt_timestamp(float(seg.get("start", 0.0)))
         end = _format_vtt_timestamp(float(seg.get("end", 0.0)))
         text = str(seg.get("text", "")).strip()
+        if seg.get("speaker"):
+            text = f"<v {seg['speaker']}>{text}"  # WebVTT voice span
         lines.append(f"{start} --> {end}")
         lines.append(text)
         lines.append("")
@@ -0,0 +1,38 @@
+"""
+Lightweight audio file inspection for Voicelogger.
+
+Nothing here loads a model or numpy, so the web front end can use it at
+upload time. PyAV (installed with faster-whisper) is imported only when a
+file is not plain WAV.
+"""
+
+from __future__ import annotations
+
+import wave
+from typing import Optional
+
+
+def probe_duration(audio_path: str) -> Optional[float]:
+    """Length of an audio file in seconds from its header, without decoding it.
+
+    Returns ``None`` if the length cannot be determined.
+    """
+    try:
+        with wave.open(audio_path, "rb") as w:
+            return w.getnframes() / float(w.getframerate())
+    except (wave.Error, EOFError, OSError):
+        pass
+    try:
+        import av  # type: ignore  # installed with faster-whisper
+    except ImportError:
+        return None
+    try:
+        with av.open(audio_path) as container:
+            if container.duration is not None:
+                return container.duration / av.time_base
+            stream = next(iter(container.streams.audio), None)
+            if stream is not None and stream.duration is not None:
+                return float(stream.duration * stream.time_base)
+    except Exception:  # PyAV raises its own error types for unreadable input
+        pass
+    return None
@@ -0,0 +1,167 @@
+"""
+Adaptive model routing for Voicelogger.
+
+Instead of running every recording through the model the user picked, a cheap
+probe looks at the audio first:
+
+1. Duration and speech ratio come from the faster-whisper VAD; near-silent
+   recordings are not transcribed at all.
+2. When the language is ``"auto"``, a tiny model detects it.
+3. Short clips go to a small model; everything else to the requested one.
+4. If the result looks unreliable (low average log-probability or a high
+   compression ratio, Whisper's usual signs of hallucination), the file is
+   transcribed again with a larger model.
+
+Every step is recorded in a *decision* dictionary that callers can store with
+the job.
+"""
+
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Union
+
+from core.diarize import SAMPLE_RATE, assign_speakers, load_audio
+from core.transcribe import get_backend, transcribe_with_info
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Whisper model sizes from cheapest to most accurate.
+MODEL_LADDER = ("tiny", "base", "small", "medium", "large-v2", "large-v3")
+
+
+def _rank(model_size: str) -> int:
+    return MODEL_LADDER.index(model_size) if model_size in MODEL_LADDER else len(MODEL_LADDER)
+
+
+def _smaller(a: str, b: str) -> str:
+    return a if _rank(a) <= _rank(b) else b
+
+
+def probe_audio(
+    audio: "np.ndarray", language: Optional[str] = "th", probe_model: str = "tiny", backend: Optional[str] = None
+) -> Dict[str, Any]:
+    """Measure duration and speech content, and detect the language if needed.
+
+    Speech is measured with the Silero VAD bundled with faster-whisper, which
+    loads no Whisper model; language detection uses ``backend``.
+
+    Args:
+        audio: 16 kHz mono waveform (see :func:`core.diarize.load_audio`).
+        language: Requested language; ``None`` or ``"auto"`` triggers detection.
+        probe_model: Model used for language detection.
+        backend: Transcription backend name (see :func:`core.transcribe.get_backend`).
+
+    Returns:
+        A dictionary with ``duration``, ``speech_seconds``, ``speech_ratio`` and
+        ``language`` (plus ``language_probability`` when it was detected).
+    """
+    from faster_whisper.vad import get_speech_timestamps  # type: ignore
+
+    duration = len(audio) / SAMPLE_RATE
+    speech = sum(ts["end"] - ts["start"] for ts in get_speech_timestamps(audio)) / SAMPLE_RATE
+    result: Dict[str, Any] = {
+        "duration": round(duration, 3),
+        "speech_seconds": round(speech, 3),
+        "speech_ratio": round(speech / duration, 4) if duration else 0.0,
+        "language": language,
+    }
+    if language in (None, "auto") and speech > 0:
+        detected, probability = get_backend(backend).detect_language(audio, probe_model)
+        result["language"] = detected
+        result["language_probability"] = round(probability, 4)
+    return result
+
+
+def _needs_escalation(details: Dict[str, Any], min_avg_logprob: float, max_compression_ratio: float) -> Optional[str]:
+    logprob, compression = details.get("avg_logprob"), details.get("compression_ratio")
+    if logprob is not None and logprob < min_avg_logprob:
+        return f"avg_logprob {logprob:.2f} < {min_avg_logprob}"
+    if compression is not None and compression > max_compression_ratio:
+        return f"compression_ratio {compression:.2f} > {max_compression_ratio}"
+    return None
+
+
+def route_and_transcribe(
+    audio_path: Union[str, "np.ndarray"],
+    model_size: str = "medium",
+    language: Optional[str] = "th",
+    diarize: bool = False,
+    max_speakers: int = 8,
+    probe_model: str = "tiny",
+    short_model: str = "small",
+    escalate_model: str = "large-v3",
+    short_seconds: float = 60.0,
+    min_speech_ratio: float = 0.02,
+    min_speech_seconds: float = 0.5,
+    min_avg_logprob: float = -1.0,
+    max_compression_ratio: float = 2.4,
+    backend: Optional[str] = None,
+) -> Tuple[List[Dict[str, float | str]], Dict[str, Any]]:
+    """Pick a model for ``audio_path`` based on its content and transcribe it.
+
+    Args:
+        audio_path: Path to the audio file, or its 16 kHz waveform.
+        model_size: Model the user asked for; used for recordings that are
+            neither short nor silent.
+        language: Language code, or ``"auto"`` to detect it with ``probe_model``.
+        diarize: Whether to label segments with speakers.
+        max_speakers: Upper bound on the number of speakers when diarizing.
+        probe_model: Model used for language detection.
+        short_model: Model for clips up to ``short_seconds`` long (never
+            larger than ``model_size``).
+        escalate_model: Model used when the first pass looks unreliable.
+        short_seconds: Duration threshold for ``short_model``.
+        min_speech_ratio: Below this fraction of speech the file is skipped.
+        min_speech_seconds: Below this many seconds of speech the file is skipped.
+        min_avg_logprob: Escalate when the average log-probability is lower.
+        max_compression_ratio: Escalate when the compression ratio is higher.
+        backend: Transcription backend for language detection and the
+            transcription passes. The escalation model is released again
+            after use, so it does not stay resident next to the others.
+
+    Returns:
+        The segments (empty for skipped files) and the routing decision: the
+        probe results, the ``action`` taken (``skip``, ``transcribe`` or
+        ``escalate``), the final ``model`` and one entry per transcription pass.
+    """
+    audio = load_audio(audio_path) if isinstance(audio_path, str) else audio_path
+    probe = probe_audio(audio, language=language, probe_model=probe_model, backend=backend)
+    decision: Dict[str, Any] = {"requested_model": model_size, "probe": probe, "passes": []}
+
+    if probe["speech_ratio"] < min_speech_ratio or probe["speech_seconds"] < min_speech_seconds:
+        decision.update(action="skip", model=None, reason="no speech detected")
+        return [], decision
+
+    if probe["duration"] <= short_seconds:
+        model = _smaller(short_model, model_size)
+        reason = f"short clip ({probe['duration']:.0f}s <= {short_seconds:.0f}s)"
+    else:
+        model, reason = model_size, "requested model"
+    decision.update(action="transcribe", reason=reason)
+
+    def run(model: str) -> Tuple[List[Dict[str, float | str]], Dict[str, Any]]:
+        started = time.perf_counter()
+        segs, details = transcribe_with_info(
+            audio, model_size=model, language=probe["language"], backend=backend
+        )
+        decision["passes"].append({"model": model, "seconds": round(time.perf_counter() - started, 3), **details})
+        return segs, details
+
+    segments, details = run(model)
+    problem = _needs_escalation(details, min_avg_logprob, max_compression_ratio)
+    if problem and _rank(escalate_model) > _rank(model):
+        try:
+            segments, details = run(escalate_model)
+        finally:
+            # Escalations are rare; keeping the largest model loaded in every
+            # worker process would cost gigabytes for little gain.
+            get_backend(backend).release(escalate_model)
+        model = escalate_model
+        decision.update(action="escalate", reason=f"{reason}; escalated: {problem}")
+    decision["model"] = model
+
+    if diarize:
+        assign_speakers(audio, segments, max_speakers=max_speakers)
+    return segments, decision
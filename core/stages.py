@@ -0,0 +1,220 @@
+"""
+Stage-graph executor for Voicelogger.
+
+Processing a file is split into stages (decode, transcribe, export, encrypt,
+...) that form a small dependency graph. Each stage has its own pool of worker
+threads and a bounded inbox, so while the model transcribes one file the next
+file is already being decoded and the previous one is being written out.
+
+Backpressure comes from two bounds: every inbox holds at most ``capacity``
+items (a fast stage blocks when the next one falls behind), and at most
+``max_in_flight`` items are inside the graph at once (the input iterator is
+not advanced until a finished item has been handed to the caller). Memory
+therefore stays bounded however many files are queued. With ``release_after``
+only the stages up to and including that one count against
+``max_in_flight``; later stages are bounded by their inboxes alone, so e.g.
+decode-ahead can be limited independently of how many files are still being
+written out.
+
+Items are plain dictionaries shared by all stages of one file; a stage reads
+what its dependencies stored and adds its own keys. Stages without a
+dependency between them may run concurrently on the same item, so they must
+write different keys.
+"""
+
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+Item = Dict[str, Any]
+
+_STOP = object()
+_FED = object()
+
+
+@dataclass
+class Stage:
+    """One step of the graph.
+
+    Attributes:
+        name: Unique stage name, referenced by ``after`` of other stages.
+        fn: Called with the item dictionary; stores its results in it.
+        after: Stages that must have finished for an item before this one runs.
+        workers: Threads running this stage (items are processed concurrently).
+        capacity: Items that may wait in this stage's inbox.
+    """
+
+    name: str
+    fn: Callable[[Item], None]
+    after: Tuple[str, ...] = ()
+    workers: int = 1
+    capacity: int = 1
+
+
+class StageGraph:
+    """Run items through a DAG of :class:`Stage` objects with bounded concurrency.
+
+    If a stage raises, the exception is stored in the item under ``"error"``
+    (and the stage name under ``"error_stage"``), the item's remaining stages
+    are skipped and the item is still yielded, so one bad file does not stop
+    a batch. The seconds spent in each stage are stored under ``"timings"``.
+
+    An item frees its ``max_in_flight`` slot when it is yielded, or as soon as
+    the ``release_after`` stage has finished (or been skipped) for it.
+    """
+
+    def __init__(self, stages: Sequence[Stage], max_in_flight: int = 2, release_after: Optional[str] = None):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        self.stages = {s.name: s for s in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError("stage names must be unique")
+        self.children: Dict[str, List[str]] = {name: [] for name in self.stages}
+        for s in stages:
+            for dep in s.after:
+                if dep not in self.stages:
+                    raise ValueError(f"stage {s.name!r} depends on unknown stage {dep!r}")
+                self.children[dep].append(s.name)
+        if release_after is not None and release_after not in self.stages:
+            raise ValueError(f"release_after names unknown stage {release_after!r}")
+        self.order = self._topological_order()
+        self.max_in_flight = max_in_flight
+        self.release_after = release_after
+
+    def _topological_order(self) -> List[str]:
+        waiting = {name: len(s.after) for name, s in self.stages.items()}
+        ready = [name for name, n in waiting.items() if n == 0]
+        order: List[str] = []
+        while ready:
+            name = ready.pop(0)
+            order.append(name)
+            for child in self.children[name]:
+                waiting[child] -= 1
+                if waiting[child] == 0:
+                    ready.append(child)
+        if len(order) != len(self.stages):
+            raise ValueError("stage graph contains a cycle")
+        return order
+
+    def run(self, items: Iterable[Item]) -> Iterator[Item]:
+        """Feed ``items`` through the graph and yield each one once all its stages are done.
+
+        Items are yielded in completion order. ``items`` is consumed lazily
+        from a background thread, only as fast as capacity frees up.
+        """
+        inboxes = {name: queue.Queue(maxsize=s.capacity) for name, s in self.stages.items()}
+        results: "queue.Queue[Any]" = queue.Queue()
+        slots = threading.Semaphore(self.max_in_flight)
+        closing = threading.Event()
+        lock = threading.Lock()
+        # Per item: stages still to finish, and unfinished dependencies per stage.
+        remaining: Dict[int, int] = {}
+        waiting: Dict[int, Dict[str, int]] = {}
+        fed = {"count": 0, "error": None}
+        roots = [name for name in self.order if not self.stages[name].after]
+
+        def advance(item: Item, finished: str) -> None:
+            key, ready = id(item), []
+            with lock:
+                remaining[key] -= 1
+                for child in self.children[finished]:
+                    waiting[key][child] -= 1
+                    if waiting[key][child] == 0:
+                        ready.append(child)
+                done = remaining[key] == 0
+                if done:
+                    del remaining[key], waiting[key]
+            if finished == self.release_after:
+                slots.release()
+            for child in ready:
+                inboxes[child].put(item)
+            if done:
+                results.put(item)
+
+        def work(stage: Stage) -> None:
+            inbox = inboxes[stage.name]
+            while True:
+                item = inbox.get()
+                if item is _STOP:
+                    return
+                if "error" not in item and not closing.is_set():
+                    started = time.perf_counter()
+                    try:
+                        stage.fn(item)
+                    except Exception as e:
+                        item.setdefault("error_stage", stage.name)
+                        item.setdefault("error", e)
+                    item.setdefault("timings", {})[stage.name] = time.perf_counter() - started
+                advance(item, stage.name)
+
+        def feed() -> None:
+            it = iter(items)
+            try:
+                while True:
+                    # Take a slot before pulling the next item, so the source
+                    # (e.g. a job queue) is never read ahead of capacity.
+                    while not slots.acquire(timeout=0.2):
+                        if closing.is_set():
+                            return
+                    item = next(it, _FED)
+                    if item is _FED or closing.is_set():
+                        return
+                    with lock:
+                        remaining[id(item)] = len(self.stages)
+                        waiting[id(item)] = {name: len(s.after) for name, s in self.stages.items()}
+                        fed["count"] += 1
+                    for name in roots:
+                        inboxes[name].put(item)
+            except Exception as e:
+                fed["error"] = e
+            finally:
+                results.put(_FED)
+
+        threads = {
+            name: [
+                threading.Thread(target=work, args=(s,), daemon=True, name=f"stage-{name}-{i}")
+                for i in range(max(1, s.workers))
+            ]
+            for name, s in self.stages.items()
+        }
+        for group in threads.values():
+            for t in group:
+                t.start()
+        feeder = threading.Thread(target=feed, daemon=True, name="stage-feeder")
+        feeder.start()
+
+        def stop_workers() -> None:
+            # Stop stages in dependency order so no item is left in an inbox.
+            for name in self.order:
+                for _ in threads[name]:
+                    inboxes[name].put(_STOP)
+                for t in threads[name]:
+                    t.join()
+
+        finished = False
+        try:
+            all_fed, yielded = False, 0
+            while not (all_fed and yielded == fed["count"]):
+                item = results.get()
+                if item is _FED:
+                    all_fed = True
+                    continue
+                yielded += 1
+                if self.release_after is None:
+                    slots.release()
+                yield item
+            finished = True
+        finally:
+            closing.set()
+            if finished:
+                stop_workers()
+            else:
+                # The caller stopped early or raised: workers skip what is left
+                # and wind down in the background.
+                threading.Thread(target=stop_workers, daemon=True, name="stage-shutdown").start()
+        if fed["error"] is not None:
+            raise fed["error"]
@@ -1,12 +1,29 @@
 """
 Transcription utilities for Voicelogger.
 
-Provides functions to transcribe audio files into segments and plain text using the
-faster-whisper library. Each segment contains start/end timestamps (in seconds) and
-its corresponding text.
+Provides functions to transcribe audio files into segments and plain text. Each
+segment contains start/end timestamps (in seconds) and its corresponding text, plus
+a speaker label when diarization is requested.
+
+The engine is pluggable (see :class:`TranscriptionBackend`): faster-whisper runs in
+process, whisper.cpp runs in a pool of resident server processes
+(:mod:`core.whispercpp`). Select one per call or with ``VOICELOGGER_BACKEND``.
 """
 
-from typing import List, Dict, Optional
+import atexit
+import os
+import threading
+import time
+import wave
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Callable, List, Dict, Optional, Tuple, Union
+
+from core.diarize import assign_speakers, load_audio
+from core.tuning import model_settings
+
+if TYPE_CHECKING:
+    import numpy as np
 
 try:
     # Import here so the module does not break if faster-whisper is missing.
@@ -15,9 +32,52 @@ except ImportError:
     WhisperModel = None  # type: ignore
 
 
+_DEFAULT_BEAM_SIZE = 5
+
+# faster-whisper models kept loaded per process, least recently used dropped
+# first. Routing may use a probe, a short-clip and the requested model, so the
+# default keeps three; every worker process holds its own copies.
+_MAX_MODELS = int(os.environ.get("VOICELOGGER_MAX_MODELS", "3"))
+_models: "OrderedDict[Tuple[str, str, str, int, int], WhisperModel]" = OrderedDict()
+_models_lock = threading.Lock()
+
+
+def _load_model(
+    model_size: str, device: str, compute_type: str, cpu_threads: int, num_workers: int
+) -> "WhisperModel":
+    key = (model_size, device, compute_type, cpu_threads, num_workers)
+    with _models_lock:
+        if key in _models:
+            _models.move_to_end(key)
+            return _models[key]
+        model = WhisperModel(
+            model_size,
+            device=device,
+            compute_type=compute_type,
+            cpu_threads=cpu_threads,
+            num_workers=num_workers,
+        )
+        _models[key] = model
+        while len(_models) > max(1, _MAX_MODELS):
+            _models.popitem(last=False)
+        return model
+
+
+def release_model(model_size: str) -> None:
+    """Drop the loaded faster-whisper model(s) of ``model_size`` from this process."""
+    with _models_lock:
+        for key in [k for k in _models if k[0] == model_size]:
+            del _models[key]
+
+
 def _get_model(model_size: str) -> "WhisperModel":
     """Load a Whisper model of the given size.
 
+    Device, compute type and thread layout come from the host's tuning profile
+    (see :mod:`core.tuning`) when one exists. Up to ``VOICELOGGER_MAX_MODELS``
+    loaded models are kept so that repeated calls in the same process do not
+    reload the weights.
+
     Raises:
         ImportError: if faster-whisper is not installed.
     """
@@ -25,46 +85,324 @@ def _get_model(model_size: str) -> "WhisperModel":
         raise ImportError(
             "faster-whisper is not installed. Install it via `pip install faster-whisper`."
         )
-    return WhisperModel(model_size)
+    settings = model_settings(model_size)
+    return _load_model(
+        model_size,
+        settings.get("device", "auto"),
+        settings.get("compute_type", "default"),
+        int(settings.get("cpu_threads", 0)),
+        int(settings.get("num_workers", 1)),
+    )
+
+
+def _resolve_beam_size(model_size: str, beam_size: Optional[int]) -> int:
+    if beam_size is not None:
+        return beam_size
+    return int(model_settings(model_size).get("beam_size", _DEFAULT_BEAM_SIZE))
+
+
+Segments = List[Dict[str, float | str]]
+
+
+def _weighted_details(
+    result: Segments, stats: List[Tuple[Optional[float], ...]], language: Optional[str],
+    language_probability: float, duration: float,
+) -> Dict[str, Any]:
+    """Build the details dictionary from per-segment ``(avg_logprob, compression_ratio, no_speech_prob)``.
+
+    Each statistic is averaged weighted by segment duration, over the segments
+    that report it.
+    """
+    sums = [0.0, 0.0, 0.0]
+    weights = [0.0, 0.0, 0.0]
+    for seg, values in zip(result, stats):
+        weight = max(float(seg["end"]) - float(seg["start"]), 1e-3)
+        for i, value in enumerate(values):
+            if value is not None:
+                sums[i] += weight * value
+                weights[i] += weight
+    avg = [sums[i] / weights[i] if weights[i] else None for i in range(3)]
+    return {
+        "language": language,
+        "language_probability": language_probability,
+        "duration": duration,
+        "avg_logprob": avg[0],
+        "compression_ratio": avg[1],
+        "no_speech_prob": avg[2],
+    }
+
+
+class TranscriptionBackend(ABC):
+    """Interface implemented by every transcription engine.
+
+    Backends are looked up by name with :func:`get_backend` and kept for the
+    lifetime of the process, so they may hold models or helper processes.
+    """
+
+    name = ""
+
+    @abstractmethod
+    def transcribe(
+        self,
+        audio: Union[str, "np.ndarray"],
+        model_size: str,
+        language: Optional[str],
+        beam_size: Optional[int],
+        vad_filter: bool,
+    ) -> Tuple[Segments, Dict[str, Any]]:
+        """Return segments and details as described in :func:`transcribe_with_info`."""
+
+    def prepare(self, audio_path: str) -> Union[str, "np.ndarray"]:
+        """Load ``audio_path`` into the input :meth:`transcribe` handles best.
+
+        Called ahead of :meth:`transcribe`, e.g. on a prefetch thread of
+        :class:`core.stages.StageGraph`, so decoding the next file overlaps
+        with inference on the current one. The default passes the path through.
+        """
+        return audio_path
+
+    def detect_language(self, audio: "np.ndarray", model_size: str) -> Tuple[Optional[str], float]:
+        """Detect the spoken language of a 16 kHz waveform with ``model_size``.
+
+        Returns the language code and its probability. The default transcribes
+        the first 30 seconds with beam size 1 and reports what the model saw.
+        """
+        _, details = self.transcribe(audio[: 30 * 16000], model_size, None, 1, True)
+        return details.get("language"), float(details.get("language_probability") or 0.0)
+
+    def release(self, model_size: str) -> None:
+        """Free what is held for ``model_size`` (e.g. a rarely used escalation model)."""
+
+    def close(self) -> None:
+        """Release models or helper processes."""
+
+
+class FasterWhisperBackend(TranscriptionBackend):
+    """In-process transcription with faster-whisper (CTranslate2)."""
+
+    name = "faster-whisper"
+
+    def prepare(self, audio_path):
+        return load_audio(audio_path)
+
+    def detect_language(self, audio, model_size):
+        # Detection runs eagerly inside transcribe(); the segment generator is
+        # never consumed, so no decoding happens.
+        _, info = _get_model(model_size).transcribe(audio[: 30 * 16000], beam_size=1, vad_filter=True)
+        return info.language, float(info.language_probability)
+
+    def release(self, model_size):
+        release_model(model_size)
+
+    def transcribe(self, audio, model_size, language, beam_size, vad_filter):
+        model = _get_model(model_size)
+        segments, info = model.transcribe(
+            audio,
+            language=language,
+            beam_size=_resolve_beam_size(model_size, beam_size),
+            vad_filter=vad_filter,
+        )
+        result: Segments = []
+        stats: List[Tuple[float, float, float]] = []
+        for seg in segments:
+            result.append(
+                {
+                    "start": float(seg.start),
+                    "end": float(seg.end),
+                    "text": seg.text.strip(),
+                }
+            )
+            stats.append((float(seg.avg_logprob), float(seg.compression_ratio), float(seg.no_speech_prob)))
+        return result, _weighted_details(
+            result, stats, info.language, float(info.language_probability), float(info.duration)
+        )
+
+
+class StubBackend(TranscriptionBackend):
+    """Sleeps for ``duration * rtf`` and returns one placeholder segment per 5 seconds.
+
+    Used by the load-testing harness in ``bench/`` so the web service can be
+    exercised without loading a model.
+    """
+
+    name = "stub"
+
+    def __init__(self, rtf: float = 0.05):
+        self.rtf = rtf
+
+    def transcribe(self, audio, model_size, language, beam_size, vad_filter):
+        if isinstance(audio, str):
+            try:
+                with wave.open(audio, "rb") as w:
+                    duration = w.getnframes() / float(w.getframerate())
+            except (wave.Error, EOFError, OSError):
+                duration = 0.0
+        else:
+            duration = len(audio) / 16000.0
+        time.sleep(duration * self.rtf)
+        segments: Segments = [
+            {"start": float(t), "end": float(min(t + 5, duration)), "text": f"stub segment {i + 1}"}
+            for i, t in enumerate(range(0, int(duration), 5))
+        ]
+        stats = [(-0.2, 1.5, 0.0)] * len(segments)
+        return segments, _weighted_details(segments, stats, language or "th", 1.0, duration)
+
+
+def _whispercpp_backend() -> TranscriptionBackend:
+    from core.whispercpp import WhisperCppBackend
+
+    return WhisperCppBackend()
+
+
+_BACKEND_FACTORIES: Dict[str, Callable[[], TranscriptionBackend]] = {
+    FasterWhisperBackend.name: FasterWhisperBackend,
+    "whisper.cpp": _whispercpp_backend,
+    StubBackend.name: lambda: StubBackend(float(os.environ.get("VOICELOGGER_STUB_TRANSCRIBER") or 0.05)),
+}
+_backends: Dict[str, TranscriptionBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def register_backend(name: str, factory: Callable[[], TranscriptionBackend]) -> None:
+    """Make a backend available to :func:`get_backend` under ``name``."""
+    _BACKEND_FACTORIES[name] = factory
+
+
+def default_backend_name() -> str:
+    """Backend selected by the environment.
+
+    ``VOICELOGGER_BACKEND`` names the backend (default ``faster-whisper``);
+    setting ``VOICELOGGER_STUB_TRANSCRIBER`` to a real-time factor selects the
+    stub backend instead.
+    """
+    if os.environ.get("VOICELOGGER_STUB_TRANSCRIBER"):
+        return StubBackend.name
+    return os.environ.get("VOICELOGGER_BACKEND", FasterWhisperBackend.name)
+
+
+def get_backend(name: Optional[str] = None) -> TranscriptionBackend:
+    """Return the process-wide instance of the named (or default) backend.
+
+    Raises:
+        ValueError: if no backend is registered under ``name``.
+    """
+    name = name or default_backend_name()
+    with _backends_lock:
+        if name not in _backends:
+            if name not in _BACKEND_FACTORIES:
+                raise ValueError(
+                    f"Unknown transcription backend {name!r}; choose from {', '.join(sorted(_BACKEND_FACTORIES))}."
+                )
+            _backends[name] = _BACKEND_FACTORIES[name]()
+        return _backends[name]
+
+
+@atexit.register
+def close_backends() -> None:
+    """Close every backend created in this process (also run at interpreter exit)."""
+    for backend in list(_backends.values()):
+        try:
+            backend.close()
+        except Exception:
+            pass
+    _backends.clear()
+
+
+def prepare_audio(
+    audio_path: str, backend: Optional[str] = None, waveform: bool = False
+) -> Union[str, "np.ndarray"]:
+    """Decode ``audio_path`` ahead of transcription (see :meth:`TranscriptionBackend.prepare`).
+
+    Args:
+        audio_path: Path to the audio file.
+        backend: Transcription backend name (see :func:`get_backend`).
+        waveform: Always return a 16 kHz waveform, as diarization and routing need.
+    """
+    if waveform:
+        return load_audio(audio_path)
+    return get_backend(backend).prepare(audio_path)
+
+
+def transcribe_with_info(
+    audio: Union[str, "np.ndarray"],
+    model_size: str = "medium",
+    language: Optional[str] = "th",
+    beam_size: Optional[int] = None,
+    vad_filter: bool = True,
+    backend: Optional[str] = None,
+) -> Tuple[Segments, Dict[str, Any]]:
+    """Transcribe audio and report how confident the model was.
+
+    Args:
+        audio: Path to an audio file or a 16 kHz mono waveform.
+        model_size: Size of the Whisper model.
+        language: Language code, or ``None``/``"auto"`` to let the model detect it.
+        beam_size: Beam size (``None`` uses the tuned value).
+        vad_filter: Whether to filter silence.
+        backend: Transcription backend name (see :func:`get_backend`).
+
+    Returns:
+        The segments (as in :func:`transcribe_to_segments`) and a dictionary with
+        ``language``, ``language_probability``, ``duration`` and the
+        duration-weighted ``avg_logprob``, ``compression_ratio`` and
+        ``no_speech_prob`` over all segments (``None`` where the backend does
+        not report a value).
+    """
+    return get_backend(backend).transcribe(
+        audio,
+        model_size,
+        None if language in (None, "auto") else language,
+        beam_size,
+        vad_filter,
+    )
 
 
 def transcribe_to_segments(
-    audio_path: str,
+    audio_path: Union[str, "np.ndarray"],
     model_size: str = "medium",
     language: str = "th",
-    beam_size: int = 5,
+    beam_size: Optional[int] = None,
     vad_filter: bool = True,
+    diarize: bool = False,
+    max_speakers: int = 8,
+    backend: Optional[str] = None,
 ) -> List[Dict[str, float | str]]:
     """Transcribe an audio file into a list of segments.
 
-    Each segment includes start time, end time and the transcribed text.
+    Each segment includes start time, end time and the transcribed text, and a
+    ``"speaker"`` label if ``diarize`` is set.
 
     Args:
-        audio_path: Path to the audio file to transcribe.
+        audio_path: Path to the audio file to transcribe, or audio already
+            loaded with :func:`prepare_audio`.
         model_size: Size of the Whisper model (e.g. "small", "medium", "large-v3").
         language: Language code to use for transcription (default is "th" for Thai).
         beam_size: Beam size for decoding. Larger values may improve accuracy at the cost of speed.
+            Defaults to the tuned value for ``model_size``, or 5 if the host is not tuned.
         vad_filter: Whether to enable Voice Activity Detection to filter out silence.
+        diarize: Whether to label segments with speakers (see :mod:`core.diarize`).
+        max_speakers: Upper bound on the number of speakers when diarizing.
+        backend: Transcription backend name; defaults to ``VOICELOGGER_BACKEND``
+            or faster-whisper.
 
     Returns:
-        A list of dictionaries with keys: "start", "end", and "text".
+        A list of dictionaries with keys: "start", "end", "text" and, when
+        diarizing, "speaker".
     """
-    model = _get_model(model_size)
-    segments, info = model.transcribe(
-        audio_path,
+    audio = audio_path
+    if diarize and isinstance(audio, str):
+        # Decode once and share the waveform between the model and the diarizer.
+        audio = load_audio(audio_path)
+    result, _ = transcribe_with_info(
+        audio,
+        model_size=model_size,
         language=language,
         beam_size=beam_size,
         vad_filter=vad_filter,
+        backend=backend,
     )
-    result: List[Dict[str, float | str]] = []
-    for seg in segments:
-        result.append(
-            {
-                "start": float(seg.start),
-                "end": float(seg.end),
-                "text": seg.text.strip(),
-            }
-        )
+    if diarize:
+        assign_speakers(audio, result, max_speakers=max_speakers)
     return result
 
 
@@ -75,13 +413,14 @@ def segments_to_text(segments: List[Dict[str, float | str]]) -> str:
         segments: List of segments with a "text" field.
 
     Returns:
-        A string containing the concatenated text from all segments separated by newlines.
+        A string containing the concatenated text from all segments separated by newlines,
+        each prefixed with its speaker label if the segments were diarized.
     """
     lines: List[str] = []
     for seg in segments:
         text = str(seg.get("text", "")).strip()
         if text:
-            lines.append(text)
+            lines.append(f"{seg['speaker']}: {text}" if seg.get("speaker") else text)
     return "\n".join(lines)
 
 
@@ -89,8 +428,9 @@ def transcribe(
     audio_path: str,
     model_size: str = "medium",
     language: str = "th",
-    beam_size: int = 5,
+    beam_size: Optional[int] = None,
     vad_filter: bool = True,
+    backend: Optional[str] = None,
 ) -> str:
     """Convenience function to transcribe an audio file and return plain text.
 
@@ -100,8 +440,9 @@ def transcribe(
         audio_path: Path to the audio file.
         model_size: Whisper model size.
         language: Language code for transcription.
-        beam_size: Beam size.
+        beam_size: Beam size (``None`` uses the tuned value).
         vad_filter: Whether to filter silence.
+        backend: Transcription backend name.
 
     Returns:
         The full transcript as a single string separated by newlines.
@@ -112,5 +453,6 @@ def transcribe(
         language=language,
         beam_size=beam_size,
         vad_filter=vad_filter,
+        backend=backend,
     )
     return segments_to_text(segments)
@@ -0,0 +1,231 @@
+"""
+Host tuning for Voicelogger.
+
+Benchmarks faster-whisper settings (compute type, CPU thread layout and beam
+size) on a short reference clip, and persists the fastest configuration whose
+transcript stays close to the float32 baseline as a *profile*. The profile is
+read by :mod:`core.transcribe` whenever a model is loaded, so the CLI, the web
+workers and any other caller pick it up automatically.
+
+The profile lives at ``~/.config/voicelogger/profile.json`` unless the
+``VOICELOGGER_PROFILE`` environment variable points elsewhere.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import socket
+import time
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_COMPUTE_TYPES = ("int8", "int8_float32", "float32")
+BASELINE_COMPUTE_TYPE = "float32"
+
+
+def profile_path() -> str:
+    """Return the path of the tuning profile for this host."""
+    return os.environ.get(
+        "VOICELOGGER_PROFILE",
+        os.path.join(os.path.expanduser("~"), ".config", "voicelogger", "profile.json"),
+    )
+
+
+@lru_cache(maxsize=4)
+def _read_profile(path: str, mtime: float) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_profile(path: Optional[str] = None) -> Dict[str, Any]:
+    """Load the tuning profile, returning an empty profile if none exists.
+
+    The parsed file is cached until its modification time changes, so this is
+    cheap enough to call on every model load.
+    """
+    path = path or profile_path()
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    try:
+        return _read_profile(path, mtime)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_profile(profile: Dict[str, Any], path: Optional[str] = None) -> str:
+    """Write ``profile`` atomically and return the path it was written to."""
+    path = path or profile_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return path
+
+
+def model_settings(model_size: str, profile: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Return the tuned settings for ``model_size``.
+
+    Models that were never tuned reuse the device, compute type and thread
+    layout of the most recently tuned model (these depend mostly on the host),
+    but not its beam size.
+
+    Returns:
+        A dictionary that may contain ``device``, ``compute_type``,
+        ``cpu_threads``, ``num_workers`` and ``beam_size``. Empty if the host
+        has not been tuned.
+    """
+    profile = load_profile() if profile is None else profile
+    models = profile.get("models", {})
+    if model_size in models:
+        return dict(models[model_size])
+    latest = profile.get("latest")
+    if latest in models:
+        settings = dict(models[latest])
+        settings.pop("beam_size", None)
+        return settings
+    return {}
+
+
+def character_error_rate(reference: str, hypothesis: str) -> float:
+    """Character-level edit distance normalised by the reference length.
+
+    Characters rather than words are compared because Thai is written without
+    spaces between words. Whitespace is ignored.
+    """
+    ref = "".join(reference.split())
+    hyp = "".join(hypothesis.split())
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    prev = list(range(len(hyp) + 1))
+    for i, rc in enumerate(ref, start=1):
+        cur = [i] + [0] * len(hyp)
+        for j, hc in enumerate(hyp, start=1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (rc != hc))
+        prev = cur
+    return prev[-1] / len(ref)
+
+
+def default_thread_layouts(cpu_count: Optional[int] = None) -> List[Tuple[int, int]]:
+    """Candidate ``(cpu_threads, num_workers)`` pairs for this host."""
+    cpus = cpu_count or os.cpu_count() or 1
+    threads = sorted({cpus, max(1, cpus // 2), max(1, cpus // 4)}, reverse=True)
+    return [(t, 1) for t in threads]
+
+
+def _run_once(model: Any, clip_path: str, language: str, beam_size: int) -> Tuple[str, float, float]:
+    """Transcribe ``clip_path`` once; return text, wall time and audio duration."""
+    start = time.perf_counter()
+    segments, info = model.transcribe(clip_path, language=language, beam_size=beam_size, vad_filter=True)
+    text = "\n".join(seg.text.strip() for seg in segments)  # segments are decoded lazily
+    return text, time.perf_counter() - start, float(info.duration)
+
+
+def benchmark(
+    clip_path: str,
+    model_size: str = "medium",
+    language: str = "th",
+    compute_types: Iterable[str] = DEFAULT_COMPUTE_TYPES,
+    thread_layouts: Optional[Iterable[Tuple[int, int]]] = None,
+    beam_sizes: Iterable[int] = (1, 5),
+    device: str = "cpu",
+    progress: Any = None,
+) -> List[Dict[str, Any]]:
+    """Benchmark every combination of settings on ``clip_path``.
+
+    Each configuration is warmed up once and then timed on a single
+    transcription, because that is how the CLI and the web workers use a
+    model: ``num_workers`` above one only pays off with concurrent calls on
+    the same model, which they never make, so its cost in per-file latency is
+    what gets measured.
+
+    Args:
+        clip_path: Short reference recording (30-60 seconds is plenty).
+        model_size: Whisper model size to tune.
+        language: Language code of the clip.
+        compute_types: CTranslate2 compute types to try.
+        thread_layouts: ``(cpu_threads, num_workers)`` pairs; defaults to
+            :func:`default_thread_layouts`.
+        beam_sizes: Beam sizes to try.
+        device: Device passed to ``WhisperModel``.
+        progress: Optional callable receiving each result as it is measured.
+
+    Returns:
+        One dictionary per configuration with its settings, ``rtf`` (wall
+        time divided by audio duration) and ``drift`` (character error rate
+        against the float32, widest-beam baseline).
+
+    Raises:
+        ImportError: if faster-whisper is not installed.
+    """
+    from core.transcribe import WhisperModel
+
+    if WhisperModel is None:
+        raise ImportError(
+            "faster-whisper is not installed. Install it via `pip install faster-whisper`."
+        )
+    layouts = list(thread_layouts or default_thread_layouts())
+    beams = sorted(set(beam_sizes), reverse=True)
+    compute_types = list(compute_types)
+    # Measure the baseline first so every later result can report its drift.
+    if BASELINE_COMPUTE_TYPE in compute_types:
+        compute_types.remove(BASELINE_COMPUTE_TYPE)
+    compute_types.insert(0, BASELINE_COMPUTE_TYPE)
+
+    results: List[Dict[str, Any]] = []
+    reference: Optional[str] = None
+    for compute_type in compute_types:
+        for cpu_threads, num_workers in layouts:
+            model = WhisperModel(
+                model_size,
+                device=device,
+                compute_type=compute_type,
+                cpu_threads=cpu_threads,
+                num_workers=num_workers,
+            )
+            _run_once(model, clip_path, language, beams[-1])  # warm-up
+            for beam_size in beams:
+                text, elapsed, audio_seconds = _run_once(model, clip_path, language, beam_size)
+                if reference is None:
+                    reference = text
+                result = {
+                    "device": device,
+                    "compute_type": compute_type,
+                    "cpu_threads": cpu_threads,
+                    "num_workers": num_workers,
+                    "beam_size": beam_size,
+                    "rtf": elapsed / audio_seconds if audio_seconds else float("inf"),
+                    "drift": character_error_rate(reference, text),
+                }
+                results.append(result)
+                if progress:
+                    progress(result)
+            del model
+    return results
+
+
+def pick_best(results: List[Dict[str, Any]], max_drift: float = 0.03) -> Dict[str, Any]:
+    """Return the fastest result whose drift does not exceed ``max_drift``.
+
+    Raises:
+        ValueError: if ``results`` is empty.
+    """
+    if not results:
+        raise ValueError("No benchmark results to choose from.")
+    acceptable = [r for r in results if r["drift"] <= max_drift] or results[:1]
+    return min(acceptable, key=lambda r: r["rtf"])
+
+
+def update_profile(model_size: str, best: Dict[str, Any], clip_path: str, path: Optional[str] = None) -> str:
+    """Record ``best`` as the tuned settings for ``model_size`` and save the profile."""
+    profile = dict(load_profile(path))
+    models = dict(profile.get("models", {}))
+    models[model_size] = {**best, "clip": os.path.basename(clip_path), "tuned_at": datetime.utcnow().isoformat() + "Z"}
+    profile.update(
+        {"host": socket.gethostname(), "cpu_count": os.cpu_count(), "models": models, "latest": model_size}
+    )
+    return save_profile(profile, path)
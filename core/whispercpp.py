@@ -0,0 +1,320 @@
+"""
+whisper.cpp transcription backend for Voicelogger.
+
+Starts a pool of long-lived ``whisper-server`` processes (the HTTP server that
+ships with whisper.cpp) bound to localhost, each with its model loaded once
+and kept resident. Requests are sent over a persistent local connection to an
+idle server, so the per-file cost is inference only. Results are returned in
+the same segment structure as the faster-whisper backend.
+
+Configuration (environment variables):
+
+- ``VOICELOGGER_WHISPERCPP_BIN``: server binary (default ``whisper-server`` on PATH).
+- ``VOICELOGGER_WHISPERCPP_MODELS``: directory holding ``ggml-<model>.bin`` files.
+- ``VOICELOGGER_WHISPERCPP_PROCESSES``: servers per model (default 1).
+- ``VOICELOGGER_WHISPERCPP_THREADS``: threads per server (default: cores / processes).
+- ``VOICELOGGER_WHISPERCPP_BEAM``: beam size when none is requested (default 5).
+  The tuned beam sizes in the tuning profile (``profile.json``, see
+  :func:`core.tuning.profile_path`) are measured for faster-whisper and are
+  not applied here.
+"""
+
+from __future__ import annotations
+
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+import wave
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
+
+from core.transcribe import Segments, TranscriptionBackend, _weighted_details
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _multipart(fields: Dict[str, str], filename: str, data: bytes) -> Tuple[bytes, str]:
+    """Encode form ``fields`` and one file as ``multipart/form-data``."""
+    boundary = uuid.uuid4().hex
+    parts: List[bytes] = []
+    for key, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'.encode()
+        )
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n".encode()
+    )
+    parts.append(data)
+    parts.append(f"\r\n--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class WhisperCppServer:
+    """One ``whisper-server`` process with a model resident in memory."""
+
+    def __init__(self, binary: str, model_path: str, threads: int, convert: bool = False, startup_timeout: float = 120.0):
+        self.port = _free_port()
+        cmd = [binary, "-m", model_path, "--host", "127.0.0.1", "--port", str(self.port), "-t", str(threads)]
+        if convert:
+            cmd.append("--convert")  # let the server decode non-WAV input with ffmpeg
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self._conn: Optional[http.client.HTTPConnection] = None
+        self._wait_ready(startup_timeout)
+
+    def _wait_ready(self, timeout: float) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"whisper-server exited with code {self.proc.returncode} during startup")
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=2)
+                conn.request("GET", "/")
+                conn.getresponse().read()
+                conn.close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        self.close()
+        raise TimeoutError(f"whisper-server did not start within {timeout:.0f}s")
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def inference(self, audio_path: str, language: Optional[str], beam_size: int) -> Dict[str, Any]:
+        """POST one file to ``/inference`` and return the ``verbose_json`` response."""
+        fields = {
+            "response_format": "verbose_json",
+            "language": language or "auto",
+            "beam_size": str(beam_size),
+            "temperature": "0.0",
+        }
+        with open(audio_path, "rb") as f:
+            body, content_type = _multipart(fields, os.path.basename(audio_path), f.read())
+        for attempt in (1, 2):
+            if self._conn is None:
+                self._conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=None)
+            try:
+                self._conn.request("POST", "/inference", body=body, headers={"Content-Type": content_type})
+                resp = self._conn.getresponse()
+                payload = resp.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # The keep-alive connection was dropped; reconnect once.
+                self._conn.close()
+                self._conn = None
+                if attempt == 2:
+                    raise
+        if resp.status != 200:
+            raise RuntimeError(f"whisper-server returned {resp.status}: {payload[:200]!r}")
+        return json.loads(payload)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+
+class WhisperCppPool:
+    """A fixed number of servers for one model; callers check one out per request."""
+
+    def __init__(self, factory, size: int):
+        self._factory = factory
+        self._idle: List[WhisperCppServer] = []
+        self._all: List[WhisperCppServer] = []
+        self._starting = 0
+        # Guards the lists above; notified whenever a server is returned or a
+        # start attempt ends, so waiting callers re-check what they can do.
+        self._cond = threading.Condition()
+        self.size = size
+
+    @contextmanager
+    def checkout(self) -> Iterator[WhisperCppServer]:
+        server = self._acquire()
+        try:
+            yield server
+        finally:
+            with self._cond:
+                self._idle.append(server)
+                self._cond.notify()
+
+    def _acquire(self) -> WhisperCppServer:
+        dead: Optional[WhisperCppServer] = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    server = self._idle.pop()
+                    if server.alive():
+                        return server
+                    self._all.remove(server)
+                    dead = server
+                # Servers are started lazily, up to ``size``. The slot is
+                # reserved here and the (slow) start happens outside the lock,
+                # so other callers can still check out running servers.
+                if len(self._all) + self._starting < self.size:
+                    self._starting += 1
+                    break
+                self._cond.wait()
+        if dead is not None:
+            dead.close()
+        return self._start()
+
+    def _start(self) -> WhisperCppServer:
+        """Start a server for a slot reserved in ``_starting``."""
+        try:
+            server = self._factory()
+        except BaseException:
+            with self._cond:
+                self._starting -= 1
+                # The slot is free again: a waiting caller retries the start
+                # (and sees the error itself if it keeps failing).
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._starting -= 1
+            self._all.append(server)
+        return server
+
+    def close(self) -> None:
+        with self._cond:
+            for server in self._all:
+                server.close()
+            self._all.clear()
+            self._idle.clear()
+
+
+class WhisperCppBackend(TranscriptionBackend):
+    """Transcribe with pooled, persistent whisper.cpp server processes.
+
+    ``vad_filter`` is ignored: whisper.cpp applies its own silence handling.
+    """
+
+    name = "whisper.cpp"
+
+    def __init__(
+        self,
+        binary: Optional[str] = None,
+        models_dir: Optional[str] = None,
+        processes: Optional[int] = None,
+        threads: Optional[int] = None,
+    ):
+        binary = binary or os.environ.get("VOICELOGGER_WHISPERCPP_BIN", "whisper-server")
+        self.binary = shutil.which(binary) or binary
+        if not os.path.isfile(self.binary):
+            raise FileNotFoundError(
+                f"whisper.cpp server binary not found: {binary!r}. Build whisper.cpp and set VOICELOGGER_WHISPERCPP_BIN."
+            )
+        self.models_dir = models_dir or os.environ.get("VOICELOGGER_WHISPERCPP_MODELS", "models")
+        self.processes = processes or int(os.environ.get("VOICELOGGER_WHISPERCPP_PROCESSES", "1"))
+        self.threads = threads or int(
+            os.environ.get("VOICELOGGER_WHISPERCPP_THREADS", str(max(1, (os.cpu_count() or 1) // self.processes)))
+        )
+        self.beam_size = int(os.environ.get("VOICELOGGER_WHISPERCPP_BEAM", "5"))
+        self.convert = shutil.which("ffmpeg") is not None
+        self._pools: Dict[str, WhisperCppPool] = {}
+        self._lock = threading.Lock()
+
+    def model_path(self, model_size: str) -> str:
+        """Resolve a model size (or an explicit path) to a ggml model file."""
+        if os.path.isfile(model_size):
+            return model_size
+        path = os.path.join(self.models_dir, f"ggml-{model_size}.bin")
+        if not os.path.isfile(path):
+            raise FileNotFoundError(
+                f"whisper.cpp model not found: {path}. Download it with whisper.cpp's models/download-ggml-model.sh."
+            )
+        return path
+
+    def _pool(self, model_size: str) -> WhisperCppPool:
+        with self._lock:
+            if model_size not in self._pools:
+                path = self.model_path(model_size)
+                self._pools[model_size] = WhisperCppPool(
+                    lambda: WhisperCppServer(self.binary, path, self.threads, convert=self.convert),
+                    self.processes,
+                )
+            return self._pools[model_size]
+
+    def prepare(self, audio_path):
+        if self.convert or audio_path.lower().endswith(".wav"):
+            return audio_path  # the server reads the file as is
+        from core.diarize import load_audio
+
+        return load_audio(audio_path)
+
+    def transcribe(self, audio, model_size, language, beam_size, vad_filter):
+        tmp: Optional[str] = None
+        if not isinstance(audio, str):
+            tmp = _write_wav(audio)
+        try:
+            with self._pool(model_size).checkout() as server:
+                response = server.inference(tmp or audio, language, beam_size or self.beam_size)
+        finally:
+            if tmp:
+                os.unlink(tmp)
+        return _parse_response(response, language)
+
+    def release(self, model_size):
+        with self._lock:
+            pool = self._pools.pop(model_size, None)
+        if pool is not None:
+            pool.close()
+
+    def close(self) -> None:
+        with self._lock:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools.clear()
+
+
+def _write_wav(audio: "np.ndarray", sampling_rate: int = 16000) -> str:
+    """Write a float waveform to a temporary 16-bit WAV file and return its path."""
+    import numpy as np  # type: ignore
+
+    pcm = (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+    fd, path = tempfile.mkstemp(prefix="voicelogger_", suffix=".wav")
+    with os.fdopen(fd, "wb") as f, wave.open(f, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sampling_rate)
+        w.writeframes(pcm)
+    return path
+
+
+def _parse_response(response: Dict[str, Any], language: Optional[str]) -> Tuple[Segments, Dict[str, Any]]:
+    segments: Segments = []
+    stats: List[Tuple[Any, Any, Any]] = []
+    for seg in response.get("segments", []):
+        text = str(seg.get("text", "")).strip()
+        if not text:
+            continue
+        segments.append({"start": float(seg.get("start", 0.0)), "end": float(seg.get("end", 0.0)), "text": text})
+        stats.append((seg.get("avg_logprob"), seg.get("compression_ratio"), seg.get("no_speech_prob")))
+    duration = float(response.get("duration") or (segments[-1]["end"] if segments else 0.0))
+    return segments, _weighted_details(
+        segments,
+        [tuple(None if v is None else float(v) for v in s) for s in stats],
+        response.get("language") or language,
+        1.0 if language else float(response.get("language_probability") or 0.0),
+        duration,
+    )
@@ -0,0 +1,88 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+from webapp.broker import Job, SQLiteBroker, new_job_id
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return tmp_path / "jobs.db"
+
+
+def _enqueue(broker, count):
+    jobs = [(Job(id=new_job_id(), filename=f"{i}.wav"), {"n": i}) for i in range(count)]
+    broker.enqueue_many(jobs)
+    return {job.id for job, _ in jobs}
+
+
+def _drain(path, worker_id):
+    # Each worker opens the database itself, as separate worker processes do.
+    broker = SQLiteBroker(path)
+    claimed = []
+    while True:
+        claim = broker.claim(worker_id, lease_seconds=60)
+        if claim is None:
+            return claimed
+        claimed.append(claim[0].id)
+
+
+def _assert_claimed_once(ids, results):
+    claimed = [job_id for worker in results for job_id in worker]
+    assert len(claimed) == len(set(claimed))
+    assert set(claimed) == ids
+
+
+def test_concurrent_threads_never_claim_the_same_job(db_path):
+    ids = _enqueue(SQLiteBroker(db_path), 200)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(_drain, [db_path] * 8, [f"t{i}" for i in range(8)]))
+    _assert_claimed_once(ids, results)
+
+
+def test_concurrent_processes_never_claim_the_same_job(db_path):
+    ids = _enqueue(SQLiteBroker(db_path), 200)
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(_drain, [db_path] * 4, [f"p{i}" for i in range(4)]))
+    _assert_claimed_once(ids, results)
+
+
+def test_expired_lease_is_requeued_for_another_worker(db_path):
+    broker = SQLiteBroker(db_path, max_attempts=3)
+    (job_id,) = _enqueue(broker, 1)
+    job, payload = broker.claim("a", lease_seconds=-1)  # lease already lapsed
+    assert job.id == job_id and job.attempts == 1
+
+    job, payload = broker.claim("b", lease_seconds=60)
+    assert job.id == job_id
+    assert job.attempts == 2
+    assert job.worker_id == "b"
+    assert payload == {"n": 0}
+    # The worker that lost its lease can no longer report an outcome.
+    assert not broker.complete(job_id, "a", "jobs/x")
+    assert not broker.heartbeat(job_id, "a", 60)
+    assert broker.complete(job_id, "b", "jobs/x")
+    assert broker.get(job_id).status == "done"
+
+
+def test_gives_up_after_max_attempts(db_path):
+    broker = SQLiteBroker(db_path, max_attempts=2)
+    (job_id,) = _enqueue(broker, 1)
+    assert broker.claim("a", lease_seconds=-1)[0].attempts == 1
+    assert broker.claim("b", lease_seconds=-1)[0].attempts == 2
+
+    assert broker.claim("c", lease_seconds=60) is None
+    job = broker.get(job_id)
+    assert job.status == "error"
+    assert job.message == "Gave up after worker lease expired"
+    assert job.worker_id is None
+    assert job.finished_at is not None
+
+
+def test_heartbeat_keeps_the_lease(db_path):
+    broker = SQLiteBroker(db_path)
+    (job_id,) = _enqueue(broker, 1)
+    broker.claim("a", lease_seconds=-1)
+    assert broker.heartbeat(job_id, "a", 60)
+    assert broker.claim("b", lease_seconds=60) is None
+    assert broker.get(job_id).worker_id == "a"
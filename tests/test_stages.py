@@ -0,0 +1,144 @@
+import threading
+import time
+
+import pytest
+
+from core.stages import Stage, StageGraph
+
+
+class Gauge:
+    """Counts items currently between two points and remembers the peak."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = 0
+        self.peak = 0
+
+    def enter(self, item):
+        with self.lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def leave(self, item):
+        with self.lock:
+            self.current -= 1
+
+
+def _sleep_then(fn, seconds=0.01):
+    def stage(item):
+        time.sleep(seconds)
+        fn(item)
+    return stage
+
+
+def test_items_in_flight_never_exceed_bound():
+    gauge = Gauge()
+    graph = StageGraph(
+        [
+            Stage("decode", gauge.enter, workers=4, capacity=4),
+            Stage("transcribe", _sleep_then(lambda item: None), after=("decode",), workers=4, capacity=4),
+            Stage("export", _sleep_then(gauge.leave), after=("transcribe",), workers=4, capacity=4),
+        ],
+        max_in_flight=2,
+    )
+    done = list(graph.run({"n": i} for i in range(20)))
+    assert sorted(item["n"] for item in done) == list(range(20))
+    assert gauge.peak == 2
+
+
+def test_release_after_bounds_only_the_early_stages():
+    early, total = Gauge(), Gauge()
+
+    def decode(item):
+        early.enter(item)
+        total.enter(item)
+
+    export_gate = threading.Event()
+
+    def export(item):
+        export_gate.wait(5)
+        total.leave(item)
+
+    graph = StageGraph(
+        [
+            Stage("decode", decode, workers=4, capacity=4),
+            Stage("transcribe", _sleep_then(early.leave), after=("decode",), workers=4, capacity=4),
+            Stage("export", export, after=("transcribe",), workers=1, capacity=4),
+        ],
+        max_in_flight=2,
+        release_after="transcribe",
+    )
+    threading.Timer(0.5, export_gate.set).start()
+    done = list(graph.run({"n": i} for i in range(8)))
+    assert len(done) == 8
+    assert early.peak <= 2
+    # With export held back, items kept entering once transcription freed their slot.
+    assert total.peak > 2
+
+
+def test_error_is_recorded_and_later_stages_are_skipped():
+    ran = []
+
+    def decode(item):
+        if item["n"] == 3:
+            raise ValueError("bad file")
+
+    def export(item):
+        ran.append(item["n"])
+
+    graph = StageGraph(
+        [
+            Stage("decode", decode),
+            Stage("export", export, after=("decode",)),
+        ],
+        max_in_flight=2,
+    )
+    done = {item["n"]: item for item in graph.run({"n": i} for i in range(6))}
+    assert sorted(done) == list(range(6))
+    assert isinstance(done[3]["error"], ValueError)
+    assert done[3]["error_stage"] == "decode"
+    assert "export" not in done[3]["timings"]
+    assert sorted(ran) == [0, 1, 2, 4, 5]
+    for n in (0, 1, 2, 4, 5):
+        assert "error" not in done[n]
+        assert set(done[n]["timings"]) == {"decode", "export"}
+
+
+def test_error_in_one_branch_skips_the_join_but_releases_the_slot():
+    def left(item):
+        raise RuntimeError("left failed")
+
+    graph = StageGraph(
+        [
+            Stage("decode", lambda item: None),
+            Stage("left", left, after=("decode",)),
+            Stage("right", lambda item: item.setdefault("right", True), after=("decode",)),
+            Stage("join", lambda item: item.setdefault("joined", True), after=("left", "right")),
+        ],
+        max_in_flight=1,
+    )
+    done = list(graph.run({"n": i} for i in range(3)))
+    assert len(done) == 3
+    for item in done:
+        assert item["error_stage"] == "left"
+        assert "joined" not in item
+
+
+def test_source_error_is_raised_after_fed_items():
+    def source():
+        yield {"n": 0}
+        raise OSError("queue went away")
+
+    graph = StageGraph([Stage("decode", lambda item: None)], max_in_flight=2)
+    seen = []
+    with pytest.raises(OSError):
+        for item in graph.run(source()):
+            seen.append(item["n"])
+    assert seen == [0]
+
+
+def test_rejects_unknown_release_after_and_cycles():
+    with pytest.raises(ValueError):
+        StageGraph([Stage("a", lambda item: None)], release_after="b")
+    with pytest.raises(ValueError):
+        StageGraph([Stage("a", lambda item: None, after=("b",)), Stage("b", lambda item: None, after=("a",))])
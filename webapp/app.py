@@ -1,34 +1,79 @@
 from __future__ import annotations
-import os, shutil, tempfile
+import json, tempfile, zipfile
+from dataclasses import asdict
 from pathlib import Path
-from typing import Optional, List
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
 
-from fastapi import FastAPI, Request, UploadFile, Form
-from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse
+from fastapi import FastAPI, HTTPException, Request, UploadFile, Form
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
-from webapp.jobs import queue, Job
+from webapp.config import (
+    ARTIFACT_NAMES, BASE_DIR, IMPORT_ROOT, MAX_AGE_DAYS, MAX_BATCH, MAX_BYTES, SWEEP_INTERVAL, TEMP_MAX_AGE_HOURS,
+)
+from webapp.jobs import queue, store, Job, new_job_id
+from webapp.retention import RetentionSweeper
 
 # ---- import core functions ----
-from core.transcribe import transcribe_to_segments, segments_to_text
-from core.summary import simple_summary
+# Transcription itself runs in `python -m webapp.worker` processes (see webapp.pipeline).
 from core.crypto import encrypt_file_aes_gcm
-from core.report import generate_markdown_report
-from core.exporters import export_txt, export_srt, export_vtt, export_json
-
-BASE_DIR = Path(__file__).resolve().parent.parent
-DATA_DIR = BASE_DIR / "web_data"
-DATA_DIR.mkdir(exist_ok=True)
+from core.media import probe_duration
 
 app = FastAPI(title="Voicelogger Web")
 app.mount("/static", StaticFiles(directory=BASE_DIR/"webapp"/"static"), name="static")
 templates = Jinja2Templates(directory=str(BASE_DIR/"webapp"/"templates"))
 
+sweeper = RetentionSweeper(store, queue.broker, MAX_AGE_DAYS, MAX_BYTES, TEMP_MAX_AGE_HOURS, SWEEP_INTERVAL)
+
+@app.on_event("startup")
+def start_sweeper():
+    sweeper.start()
+
+@app.on_event("shutdown")
+def stop_sweeper():
+    sweeper.stop()
+
+def _prepare_job(
+    job_id: str, filename: str, src: BinaryIO, options: Dict[str, Any], passphrase: Optional[str] = None
+) -> Tuple[str, Dict[str, Any]]:
+    """Store an upload in the job's directory and build the worker payload.
+
+    Returns:
+        The (possibly renamed) file name and the payload to enqueue.
+    """
+    filename = Path(filename).name
+    if filename in ARTIFACT_NAMES or filename.startswith("."):
+        filename = f"original_{filename}"
+    # Hash while streaming into the blob store; identical uploads share one blob.
+    digest = store.ingest_stream(src)
+    jobdir = store.job_dir(job_id)
+    in_path = store.link(digest, jobdir / filename)
+    digests = [digest]
+
+    # Encrypt here rather than in the worker so the passphrase never reaches the job store.
+    if passphrase:
+        meta = encrypt_file_aes_gcm(str(in_path), str(jobdir/"audio.enc"), passphrase)
+        (jobdir/"audio.enc.meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+        for name in ("audio.enc", "audio.enc.meta.json"):
+            digests.append(store.intern(jobdir / name)[0])
+    store.record(job_id, digests)
+
+    payload = {
+        "filename": filename,
+        # audio length from the file header; the scheduler ranks jobs by predicted run time
+        "duration": probe_duration(str(in_path)),
+        **options,
+        # the plaintext is only kept until it has been transcribed
+        "discard_original": bool(passphrase),
+    }
+    return filename, payload
+
 @app.get("/", response_class=HTMLResponse)
 def index(request: Request):
-    jobs = sorted(queue.jobs.values(), key=lambda j: j.created_at, reverse=True)
-    return templates.TemplateResponse("index.html", {"request": request, "jobs": jobs})
+    jobs = queue.list()
+    return templates.TemplateResponse(request, "index.html", {"jobs": jobs})
 
 @app.post("/upload", response_class=RedirectResponse)
 async def upload(
@@ -41,57 +86,25 @@ async def upload(
     do_vtt: bool = Form(True),
     do_json: bool = Form(True),
     do_summary: bool = Form(True),
+    do_diarize: bool = Form(False),
+    route: bool = Form(False),
     passphrase: Optional[str] = Form(None),
 ):
-    tmpdir = Path(tempfile.mkdtemp(prefix="voicelogger_"))
-    in_path = tmpdir / file.filename
-    with open(in_path, "wb") as f:
-        f.write(await file.read())
-
-    def worker() -> str:
-        # outdir
-        outdir = DATA_DIR / in_path.stem
-        outdir.mkdir(exist_ok=True)
-
-        # 1) transcribe
-        segs = transcribe_to_segments(str(in_path), model_size=model, language=language)
-        text = segments_to_text(segs)
-        (outdir/"transcript.txt").write_text(text, encoding="utf-8")
-
-        # 2) summary
-        if do_summary:
-            summ = simple_summary(text, max_sentences=5)
-            (outdir/"summary.txt").write_text(summ, encoding="utf-8")
-        else:
-            summ = ""
-
-        # 3) exporters
-        if do_txt:
-            export_txt(segs, outdir / "transcript.txt")  # overwrite with clean text
-        if do_srt:
-            export_srt(segs, outdir / "subtitle.srt")
-        if do_vtt:
-            export_vtt(segs, outdir / "subtitle.vtt")
-        if do_json:
-            export_json(segs, outdir / "segments.json")
-
-        # 4) report
-        report_md = generate_markdown_report(text, summ, in_path.name)
-        (outdir/"report.md").write_text(report_md, encoding="utf-8")
-
-        # 5) encryption (optional)
-        if passphrase:
-            enc_path = outdir/"audio.enc"
-            encrypt_file_aes_gcm(str(in_path), str(enc_path), passphrase)
-
-        # preserve original
-        shutil.copy2(in_path, outdir / file.filename)
-        return str(outdir)
-
-    job = queue.submit(
-        worker,
-        filename=file.filename,
-    )
+    options = {
+        "model": model,
+        "language": language,
+        "do_txt": do_txt,
+        "do_srt": do_srt,
+        "do_vtt": do_vtt,
+        "do_json": do_json,
+        "do_summary": do_summary,
+        "diarize": do_diarize,
+        "route": route,
+    }
+    job_id = new_job_id()
+    filename, payload = await run_in_threadpool(_prepare_job, job_id, file.filename, file.file, options, passphrase)
+    # Enqueueing is a SQLite write that may wait for a worker's lock: keep it off the event loop.
+    job = await run_in_threadpool(queue.submit, payload, filename=filename, job_id=job_id)
     return RedirectResponse(url=f"/jobs/{job.id}", status_code=303)
 
 @app.get("/jobs/{job_id}", response_class=HTMLResponse)
@@ -100,16 +113,262 @@ def job_detail(request: Request, job_id: str):
     if not job:
         return HTMLResponse("Job not found", status_code=404)
     files: List[str] = []
-    if job.result_dir and Path(job.result_dir).exists():
-        files = [p.name for p in Path(job.result_dir).iterdir() if p.is_file()]
-    return templates.TemplateResponse("job_detail.html", {"request": request, "job": job, "files": files})
+    root = store.resolve(job.result_dir) if job.result_dir else None
+    if root and root.exists():
+        files = [p.name for p in root.iterdir() if p.is_file() and not p.name.startswith(".")]
+    estimate = queue.estimates([job]).get(job.id)
+    if "application/json" in request.headers.get("accept", ""):
+        return JSONResponse({**asdict(job), "files": files, "estimate": estimate})
+    return templates.TemplateResponse(
+        request, "job_detail.html", {"job": job, "files": files, "estimate": estimate}
+    )
 
 @app.get("/download/{job_id}/{name}")
 def download(job_id: str, name: str):
     job = queue.get(job_id)
     if not job or not job.result_dir:
         return HTMLResponse("Not ready", status_code=404)
-    path = Path(job.result_dir) / name
-    if not path.exists():
+    path = store.resolve(job.result_dir) / name
+    if name != Path(name).name or name.startswith(".") or not path.is_file():
         return HTMLResponse("File not found", status_code=404)
     return FileResponse(path)
+
+# ---- JSON API for batch integrations ----
+# POST /api/jobs takes many files (multipart) or server-side paths (JSON) in
+# one request and answers with job ids right away. Status and results are
+# fetched for many jobs per request; status only touches the broker index.
+
+# Per-job options accepted by the API, with the same defaults as the form.
+API_OPTIONS: Dict[str, Any] = {
+    "model": "medium",
+    "language": "th",
+    "do_txt": True,
+    "do_srt": True,
+    "do_vtt": True,
+    "do_json": True,
+    "do_summary": True,
+    "diarize": False,
+    "route": False,
+}
+# Inlined by /api/jobs/results?format=json unless ``files`` is given.
+_TEXT_RESULTS = ("transcript.txt", "summary.txt", "segments.json", "routing.json")
+# Everything format=json may inline; audio and other binaries need format=zip.
+_INLINE_RESULTS = frozenset(_TEXT_RESULTS) | {"subtitle.srt", "subtitle.vtt", "report.md"}
+_STATUS_FIELDS = (
+    "id", "filename", "status", "message", "created_at", "started_at", "finished_at", "attempts",
+    "duration", "predicted_s",
+)
+
+
+def _job_options(defaults: Any, overrides: Any) -> Tuple[Dict[str, Any], Optional[str]]:
+    """Merge request-wide ``defaults`` with one job's ``overrides``; also return the passphrase."""
+    merged = dict(API_OPTIONS)
+    for raw in (defaults, overrides):
+        if raw is None:
+            continue
+        if not isinstance(raw, dict):
+            raise HTTPException(422, "job options must be JSON objects")
+        merged.update(raw)
+    passphrase = merged.pop("passphrase", None)
+    merged.pop("path", None)
+    unknown = set(merged) - set(API_OPTIONS)
+    if unknown:
+        raise HTTPException(422, f"unknown options: {', '.join(sorted(unknown))}")
+    for key, default in API_OPTIONS.items():
+        if not isinstance(merged[key], type(default)):
+            raise HTTPException(422, f"option {key!r} must be a {type(default).__name__}")
+    if passphrase is not None and not isinstance(passphrase, str):
+        raise HTTPException(422, "option 'passphrase' must be a str")
+    return merged, passphrase or None
+
+
+def _import_path(raw: Any) -> Path:
+    if IMPORT_ROOT is None:
+        raise HTTPException(403, "server-side paths are disabled; set VOICELOGGER_IMPORT_ROOT")
+    if not isinstance(raw, str) or not raw:
+        raise HTTPException(422, "'path' must be a non-empty string")
+    path = (IMPORT_ROOT / raw).resolve()
+    if not path.is_relative_to(IMPORT_ROOT) or not path.is_file():
+        raise HTTPException(422, f"not a file below the import root: {raw}")
+    return path
+
+
+def _parse_ids(ids: Any) -> List[str]:
+    if isinstance(ids, str):
+        ids = [i for i in ids.split(",") if i]
+    if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+        raise HTTPException(422, "'ids' must be a list of job ids")
+    if len(ids) > MAX_BATCH:
+        raise HTTPException(413, f"at most {MAX_BATCH} jobs per request")
+    return list(dict.fromkeys(ids))
+
+
+async def _json_object(request: Request) -> Dict[str, Any]:
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        raise HTTPException(422, "expected a JSON object")
+    return body
+
+
+def _submit_batch(sources: List[Tuple[str, Any, Dict[str, Any], Optional[str]]]) -> List[Job]:
+    """Store every ``(filename, source, options, passphrase)`` and enqueue them together.
+
+    ``source`` is a file object or a :class:`Path` below the import root.
+    """
+    items = []
+    for name, src, options, passphrase in sources:
+        job_id = new_job_id()
+        if isinstance(src, Path):
+            with open(src, "rb") as f:
+                filename, payload = _prepare_job(job_id, name, f, options, passphrase)
+        else:
+            filename, payload = _prepare_job(job_id, name, src, options, passphrase)
+        items.append((job_id, filename, payload))
+    return queue.submit_many(items)
+
+
+@app.post("/api/jobs", status_code=202)
+async def api_submit(request: Request):
+    """Submit a batch of jobs.
+
+    ``multipart/form-data``: one or more ``files`` parts, an optional
+    ``defaults`` field (JSON object of options for every file) and an optional
+    ``options`` field (JSON list with one object per file).
+
+    ``application/json``: ``{"defaults": {...}, "jobs": [{"path": "...", ...}]}``
+    where each path is relative to ``VOICELOGGER_IMPORT_ROOT``.
+    """
+    sources: List[Tuple[str, Any, Dict[str, Any], Optional[str]]] = []
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await request.form(max_files=MAX_BATCH)
+        files = [f for f in form.getlist("files") if not isinstance(f, str)]
+        try:
+            defaults = json.loads(form.get("defaults") or "null")
+            per_file = json.loads(form.get("options") or "null") or [None] * len(files)
+        except json.JSONDecodeError as e:
+            raise HTTPException(422, f"invalid JSON in form field: {e}")
+        if not isinstance(per_file, list) or len(per_file) != len(files):
+            raise HTTPException(422, "'options' must be a list with one entry per file")
+        for f, overrides in zip(files, per_file):
+            sources.append((f.filename or "upload", f.file, *_job_options(defaults, overrides)))
+    else:
+        body = await _json_object(request)
+        jobs = body.get("jobs")
+        if not isinstance(jobs, list):
+            raise HTTPException(422, "'jobs' must be a list")
+        for spec in jobs:
+            options, passphrase = _job_options(body.get("defaults"), spec)
+            path = _import_path(spec.get("path"))
+            sources.append((path.name, path, options, passphrase))
+    if not sources:
+        raise HTTPException(422, "no files submitted")
+    if len(sources) > MAX_BATCH:
+        raise HTTPException(413, f"at most {MAX_BATCH} jobs per request")
+    # Everything was validated above, so a bad entry never leaves a partial batch.
+    jobs = await run_in_threadpool(_submit_batch, sources)
+    return {"jobs": [{"id": j.id, "filename": j.filename, "status": j.status} for j in jobs]}
+
+
+def _status_response(ids: List[str]) -> Dict[str, Any]:
+    found = {j.id: j for j in queue.get_many(ids)}
+    estimates = queue.estimates(list(found.values()))
+    jobs = [
+        {**{k: getattr(found[i], k) for k in _STATUS_FIELDS}, "estimate": estimates.get(i)}
+        for i in ids if i in found
+    ]
+    return {"jobs": jobs, "missing": [i for i in ids if i not in found]}
+
+
+@app.get("/api/jobs")
+def api_status(ids: str = ""):
+    """Status of many jobs: ``GET /api/jobs?ids=a,b,c``."""
+    return _status_response(_parse_ids(ids))
+
+
+@app.post("/api/jobs/status")
+async def api_status_bulk(request: Request):
+    """Status of many jobs: ``{"ids": [...]}`` (for id lists too long for a URL)."""
+    body = await _json_object(request)
+    return await run_in_threadpool(_status_response, _parse_ids(body.get("ids")))
+
+
+def _result_files(job: Job, names: Optional[List[str]]) -> List[Path]:
+    if job.status != "done" or not job.result_dir:
+        return []
+    root = store.resolve(job.result_dir)
+    if names is None:
+        return sorted(p for p in root.iterdir() if p.is_file() and not p.name.startswith("."))
+    return [root / n for n in names if n == Path(n).name and not n.startswith(".") and (root / n).is_file()]
+
+
+def _zip_results(jobs: List[Job], names: Optional[List[str]]) -> BinaryIO:
+    buf = tempfile.SpooledTemporaryFile(max_size=32 << 20)
+    with zipfile.ZipFile(buf, "w") as zf:
+        for job in jobs:
+            for path in _result_files(job, names):
+                # Audio is already compressed; only deflate the text artifacts.
+                compress = zipfile.ZIP_STORED if path.name == job.filename or path.suffix == ".enc" else zipfile.ZIP_DEFLATED
+                zf.write(path, f"{job.id}/{path.name}", compress_type=compress)
+    buf.seek(0)
+    return buf
+
+
+def _inline_results(jobs: List[Job], names: Optional[List[str]]) -> List[Dict[str, Any]]:
+    out = []
+    for job in jobs:
+        files: Dict[str, Any] = {}
+        for path in _result_files(job, names if names is not None else list(_TEXT_RESULTS)):
+            text = path.read_text(encoding="utf-8")
+            files[path.name] = json.loads(text) if path.suffix == ".json" else text
+        out.append({"id": job.id, "status": job.status, "message": job.message, "files": files})
+    return out
+
+
+async def _results_response(ids: List[str], names: Optional[List[str]], fmt: str):
+    # Broker reads block on SQLite: run them on the thread pool, not the event loop.
+    found = {j.id: j for j in await run_in_threadpool(queue.get_many, ids)}
+    jobs = [found[i] for i in ids if i in found]
+    missing = [i for i in ids if i not in found]
+    if fmt == "zip":
+        buf = await run_in_threadpool(_zip_results, jobs, names)
+
+        def chunks():
+            with buf:
+                while chunk := buf.read(1 << 20):
+                    yield chunk
+
+        return StreamingResponse(
+            chunks(), media_type="application/zip",
+            headers={"Content-Disposition": 'attachment; filename="voicelogger-results.zip"'},
+        )
+    if fmt != "json":
+        raise HTTPException(422, "'format' must be 'json' or 'zip'")
+    binary = sorted(set(names or ()) - _INLINE_RESULTS)
+    if binary:
+        raise HTTPException(422, f"only text results can be inlined, use format=zip for: {', '.join(binary)}")
+    return {"jobs": await run_in_threadpool(_inline_results, jobs, names), "missing": missing}
+
+
+@app.get("/api/jobs/results")
+async def api_results(ids: str = "", files: Optional[str] = None, format: str = "json"):
+    """Results of many jobs: ``GET /api/jobs/results?ids=a,b&format=zip``."""
+    return await _results_response(_parse_ids(ids), files.split(",") if files else None, format)
+
+
+@app.post("/api/jobs/results")
+async def api_results_bulk(request: Request):
+    """Results of many jobs: ``{"ids": [...], "files": [...], "format": "json" | "zip"}``.
+
+    ``json`` inlines the text artifacts (transcript, summary, segments,
+    routing decision by default; subtitles and the report on request) of
+    finished jobs; ``zip`` bundles the requested files,
+    or every result file, as ``<job id>/<name>``.
+    """
+    body = await _json_object(request)
+    names = body.get("files")
+    if names is not None and (not isinstance(names, list) or not all(isinstance(n, str) for n in names)):
+        raise HTTPException(422, "'files' must be a list of file names")
+    return await _results_response(_parse_ids(body.get("ids")), names, body.get("format", "json"))
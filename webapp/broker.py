@@ -0,0 +1,348 @@
+"""Job brokers for Voicelogger.
+
+The web front end only enqueues jobs and reads their state; worker processes
+(``python -m webapp.worker``) claim jobs from the broker under a time-limited
+lease which they renew with heartbeats. A job whose lease runs out (worker
+crashed or host went away) is handed to another worker, up to ``max_attempts``.
+
+Queued jobs are claimed shortest predicted run time first, with aging: a job's
+rank is ``predicted_s - aging * seconds waited``, so short recordings overtake
+long ones but a long job is not passed over forever. ``aging=0`` is pure
+shortest-job-first; a large value approaches FIFO.
+
+:class:`SQLiteBroker` needs no external service: every process on every host
+just opens the same database file on shared storage.
+"""
+from __future__ import annotations
+import json, sqlite3, time, uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from webapp.db import SQLiteDB
+
+
+@dataclass
+class Job:
+    id: str
+    filename: str
+    status: str = "queued"   # queued | running | done | error | expired
+    message: str = ""
+    result_dir: Optional[str] = None  # relative to the data directory (see BlobStore.resolve)
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None    # set when transcription begins; None while a claim waits
+    finished_at: Optional[float] = None
+    attempts: int = 0
+    worker_id: Optional[str] = None
+    lease_expires: Optional[float] = None
+    duration: Optional[float] = None      # audio length in seconds, probed at submit
+    predicted_s: Optional[float] = None   # predicted run time in seconds
+    meta: Dict[str, Any] = field(default_factory=dict)  # e.g. the routing decision
+
+
+def new_job_id() -> str:
+    return str(uuid.uuid4())
+
+
+class JobBroker(ABC):
+    """Interface shared by the front end (enqueue/read) and workers (claim/ack)."""
+
+    @abstractmethod
+    def enqueue(self, job: Job, payload: Dict[str, Any]) -> Job:
+        """Store a new queued job together with the payload the worker needs."""
+
+    def enqueue_many(self, items: List[Tuple[Job, Dict[str, Any]]]) -> List[Job]:
+        """Enqueue several jobs; brokers override this to do it in one transaction."""
+        return [self.enqueue(job, payload) for job, payload in items]
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Job]:
+        ...
+
+    def get_many(self, job_ids: List[str]) -> List[Job]:
+        """The jobs that exist among ``job_ids``, in no particular order."""
+        return [job for job in map(self.get, job_ids) if job is not None]
+
+    @abstractmethod
+    def list_jobs(self, limit: int = 100) -> List[Job]:
+        """Most recent jobs first."""
+
+    @abstractmethod
+    def claim(self, worker_id: str, lease_seconds: float) -> Optional[Tuple[Job, Dict[str, Any]]]:
+        """Atomically take the next runnable job, or return ``None`` if there is none."""
+
+    @abstractmethod
+    def start(self, job_id: str, worker_id: str) -> bool:
+        """Record that a claimed job's processing has begun (prefetched jobs wait after ``claim``)."""
+
+    @abstractmethod
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        """Extend the lease; ``False`` means the worker no longer owns the job."""
+
+    @abstractmethod
+    def complete(
+        self, job_id: str, worker_id: str, result_dir: str, message: str = "Completed",
+        meta: Optional[Dict[str, Any]] = None,
+    ) -> bool:
+        ...
+
+    @abstractmethod
+    def fail(self, job_id: str, worker_id: str, message: str) -> bool:
+        ...
+
+    @abstractmethod
+    def expire(self, job_id: str, message: str) -> bool:
+        """Mark a finished job's results as deleted; ``False`` if it is queued or running."""
+
+    @abstractmethod
+    def queue_snapshot(self) -> Tuple[List[Job], List[Job]]:
+        """Queued jobs and the running (claimed) jobs, each in claim order (used for ETAs)."""
+
+    @abstractmethod
+    def record_runtime(
+        self, host: str, key: str, audio_seconds: float, run_seconds: float, alpha: float = 0.2
+    ) -> None:
+        """Fold one real-time factor observed on ``host`` into its moving average for ``key``."""
+
+    @abstractmethod
+    def runtime_factors(self) -> Dict[str, float]:
+        """Real-time factor (run time / audio length) per key.
+
+        Hosts keep separate averages; they are combined weighted by the number
+        of jobs each host has reported, i.e. by how much of the work it runs.
+        """
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    status TEXT NOT NULL,
+    message TEXT NOT NULL DEFAULT '',
+    result_dir TEXT,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker_id TEXT,
+    lease_expires REAL,
+    meta TEXT,
+    duration REAL,
+    predicted_s REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at);
+CREATE TABLE IF NOT EXISTS host_runtime_factors (
+    host TEXT NOT NULL,
+    key TEXT NOT NULL,
+    rtf REAL NOT NULL,
+    samples INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (host, key)
+);
+"""
+
+_JOB_COLUMNS = (
+    "id, filename, status, message, result_dir, created_at, started_at, "
+    "finished_at, attempts, worker_id, lease_expires, duration, predicted_s, meta"
+)
+
+_IN_CHUNK = 500
+
+# Columns added after the first release; created on open if missing.
+_MIGRATIONS = {
+    "meta": "ALTER TABLE jobs ADD COLUMN meta TEXT",
+    "duration": "ALTER TABLE jobs ADD COLUMN duration REAL",
+    "predicted_s": "ALTER TABLE jobs ADD COLUMN predicted_s REAL",
+}
+
+# Run time assumed for jobs submitted without a prediction.
+UNPREDICTED_SECONDS = 600.0
+# Rank of a queued job: lower is claimed first (see the module docstring).
+_RANK = f"COALESCE(predicted_s, {UNPREDICTED_SECONDS}) + ? * created_at"
+
+
+def _row_to_job(row: sqlite3.Row) -> Job:
+    fields = {k: row[k] for k in Job.__dataclass_fields__}
+    fields["meta"] = json.loads(fields["meta"]) if fields["meta"] else {}
+    return Job(**fields)
+
+
+class SQLiteBroker(JobBroker):
+    """Broker backed by a single SQLite file.
+
+    Claims run inside ``BEGIN IMMEDIATE`` transactions, so concurrent workers
+    never take the same job. See :class:`webapp.db.SQLiteDB` for the journal
+    mode on network filesystems.
+    """
+
+    def __init__(self, path: str | Path, max_attempts: int = 3, journal_mode: str = "WAL", aging: float = 1.0):
+        self.db = SQLiteDB(path, journal_mode)
+        self.path = self.db.path
+        self.max_attempts = max_attempts
+        self.aging = aging
+        conn = self.db.conn()
+        conn.executescript(_SCHEMA)
+        columns = {r["name"] for r in conn.execute("PRAGMA table_info(jobs)")}
+        for column, ddl in _MIGRATIONS.items():
+            if column not in columns:
+                conn.execute(ddl)
+
+    def enqueue(self, job: Job, payload: Dict[str, Any]) -> Job:
+        return self.enqueue_many([(job, payload)])[0]
+
+    def enqueue_many(self, items: List[Tuple[Job, Dict[str, Any]]]) -> List[Job]:
+        for job, _ in items:
+            job.status = "queued"
+        with self.db.tx() as conn:
+            conn.executemany(
+                "INSERT INTO jobs (id, filename, status, message, payload, created_at, duration, predicted_s) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(job.id, job.filename, job.status, job.message, json.dumps(payload), job.created_at,
+                  job.duration, job.predicted_s)
+                 for job, payload in items],
+            )
+        return [job for job, _ in items]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        row = self.db.conn().execute(f"SELECT {_JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _row_to_job(row) if row else None
+
+    def get_many(self, job_ids: List[str]) -> List[Job]:
+        conn, jobs = self.db.conn(), []
+        # Primary-key lookups in chunks that stay below SQLite's bound-parameter limit.
+        for i in range(0, len(job_ids), _IN_CHUNK):
+            chunk = job_ids[i:i + _IN_CHUNK]
+            rows = conn.execute(
+                f"SELECT {_JOB_COLUMNS} FROM jobs WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            jobs += [_row_to_job(r) for r in rows]
+        return jobs
+
+    def list_jobs(self, limit: int = 100) -> List[Job]:
+        rows = self.db.conn().execute(
+            f"SELECT {_JOB_COLUMNS} FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [_row_to_job(r) for r in rows]
+
+    def _reap_expired(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute(
+            "UPDATE jobs SET status = 'error', message = 'Gave up after worker lease expired', "
+            "worker_id = NULL, lease_expires = NULL, finished_at = ? "
+            "WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+            (now, now, self.max_attempts),
+        )
+        conn.execute(
+            "UPDATE jobs SET status = 'queued', message = 'Requeued after worker lease expired', "
+            "worker_id = NULL, lease_expires = NULL "
+            "WHERE status = 'running' AND lease_expires < ?",
+            (now,),
+        )
+
+    def claim(self, worker_id: str, lease_seconds: float) -> Optional[Tuple[Job, Dict[str, Any]]]:
+        now = time.time()
+        with self.db.tx() as conn:
+            self._reap_expired(conn, now)
+            row = conn.execute(
+                f"SELECT {_JOB_COLUMNS}, payload FROM jobs WHERE status = 'queued' "
+                f"ORDER BY {_RANK} LIMIT 1",
+                (self.aging,),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', message = '', worker_id = ?, lease_expires = ?, "
+                "attempts = attempts + 1, started_at = NULL WHERE id = ?",
+                (worker_id, now + lease_seconds, row["id"]),
+            )
+        job = _row_to_job(row)
+        job.status, job.message, job.worker_id = "running", "", worker_id
+        job.lease_expires, job.started_at, job.attempts = now + lease_seconds, None, job.attempts + 1
+        return job, json.loads(row["payload"])
+
+    def start(self, job_id: str, worker_id: str) -> bool:
+        with self.db.tx() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET started_at = ? WHERE id = ? AND worker_id = ? AND status = 'running'",
+                (time.time(), job_id, worker_id),
+            )
+        return cur.rowcount == 1
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        with self.db.tx() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND worker_id = ? AND status = 'running'",
+                (time.time() + lease_seconds, job_id, worker_id),
+            )
+        return cur.rowcount == 1
+
+    def _finish(
+        self, job_id: str, worker_id: str, status: str, message: str,
+        result_dir: Optional[str], meta: Optional[Dict[str, Any]] = None,
+    ) -> bool:
+        # Guarded by worker_id so a worker that lost its lease cannot overwrite
+        # the outcome of whoever re-ran the job.
+        with self.db.tx() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = ?, message = ?, result_dir = ?, finished_at = ?, "
+                "lease_expires = NULL, meta = ? WHERE id = ? AND worker_id = ? AND status = 'running'",
+                (status, message, result_dir, time.time(), json.dumps(meta) if meta else None, job_id, worker_id),
+            )
+        return cur.rowcount == 1
+
+    def complete(
+        self, job_id: str, worker_id: str, result_dir: str, message: str = "Completed",
+        meta: Optional[Dict[str, Any]] = None,
+    ) -> bool:
+        return self._finish(job_id, worker_id, "done", message, result_dir, meta)
+
+    def fail(self, job_id: str, worker_id: str, message: str) -> bool:
+        return self._finish(job_id, worker_id, "error", message, None)
+
+    def expire(self, job_id: str, message: str) -> bool:
+        with self.db.tx() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = 'expired', message = ?, result_dir = NULL "
+                "WHERE id = ? AND status IN ('done', 'error', 'expired')",
+                (message, job_id),
+            )
+        return cur.rowcount == 1
+
+    def queue_snapshot(self) -> Tuple[List[Job], List[Job]]:
+        conn = self.db.conn()
+        queued = conn.execute(
+            f"SELECT {_JOB_COLUMNS} FROM jobs WHERE status = 'queued' ORDER BY {_RANK}", (self.aging,)
+        ).fetchall()
+        running = conn.execute(
+            f"SELECT {_JOB_COLUMNS} FROM jobs WHERE status = 'running' ORDER BY {_RANK}", (self.aging,)
+        ).fetchall()
+        return [_row_to_job(r) for r in queued], [_row_to_job(r) for r in running]
+
+    def record_runtime(
+        self, host: str, key: str, audio_seconds: float, run_seconds: float, alpha: float = 0.2
+    ) -> None:
+        rtf = run_seconds / audio_seconds
+        with self.db.tx() as conn:
+            conn.execute(
+                "INSERT INTO host_runtime_factors (host, key, rtf, samples, updated_at) VALUES (?, ?, ?, 1, ?) "
+                "ON CONFLICT (host, key) DO UPDATE SET rtf = (1 - ?) * rtf + ? * excluded.rtf, "
+                "samples = samples + 1, updated_at = excluded.updated_at",
+                (host, key, rtf, time.time(), alpha, alpha),
+            )
+
+    def runtime_factors(self) -> Dict[str, float]:
+        rows = self.db.conn().execute(
+            "SELECT key, SUM(rtf * samples) / SUM(samples) AS rtf FROM host_runtime_factors GROUP BY key"
+        ).fetchall()
+        return {r["key"]: r["rtf"] for r in rows}
+
+
+def make_broker(url: str, max_attempts: int = 3, aging: float = 1.0) -> JobBroker:
+    """Create a broker from a URL such as ``sqlite:///web_data/jobs.db``."""
+    if url.startswith("sqlite:///"):
+        path, _, query = url[len("sqlite:///"):].partition("?")
+        opts = dict(p.split("=", 1) for p in query.split("&") if "=" in p)
+        return SQLiteBroker(path, max_attempts=max_attempts, journal_mode=opts.get("journal", "WAL"), aging=aging)
+    raise ValueError(f"Unsupported broker URL: {url!r}")
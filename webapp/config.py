@@ -0,0 +1,50 @@
+"""Runtime settings shared by the web front end and the worker processes.
+
+Everything is read from the environment so several hosts can point at the same
+shared ``VOICELOGGER_DATA_DIR`` and job broker.
+"""
+from __future__ import annotations
+import os
+from pathlib import Path
+from typing import Any, Dict
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DATA_DIR = Path(os.environ.get("VOICELOGGER_DATA_DIR", str(BASE_DIR / "web_data")))
+INCOMING_DIR = DATA_DIR / "incoming"
+
+# sqlite:///relative/path.db or sqlite:////absolute/path.db
+BROKER_URL = os.environ.get("VOICELOGGER_BROKER_URL", f"sqlite:///{DATA_DIR / 'jobs.db'}")
+LEASE_SECONDS = float(os.environ.get("VOICELOGGER_LEASE_SECONDS", "60"))
+MAX_ATTEMPTS = int(os.environ.get("VOICELOGGER_MAX_ATTEMPTS", "3"))
+POLL_INTERVAL = float(os.environ.get("VOICELOGGER_POLL_INTERVAL", "1.0"))
+
+# Retention (see webapp.retention); 0 disables the age limit / the size quota.
+MAX_AGE_DAYS = float(os.environ.get("VOICELOGGER_MAX_AGE_DAYS", "30"))
+MAX_BYTES = int(os.environ.get("VOICELOGGER_MAX_BYTES", "0"))
+SWEEP_INTERVAL = float(os.environ.get("VOICELOGGER_SWEEP_INTERVAL", "60"))
+TEMP_MAX_AGE_HOURS = float(os.environ.get("VOICELOGGER_TEMP_MAX_AGE_HOURS", "24"))
+
+# JSON API (see webapp.app): server-side paths may only be submitted from
+# below VOICELOGGER_IMPORT_ROOT (unset = path submission disabled).
+IMPORT_ROOT = Path(os.environ["VOICELOGGER_IMPORT_ROOT"]).resolve() if os.environ.get("VOICELOGGER_IMPORT_ROOT") else None
+MAX_BATCH = int(os.environ.get("VOICELOGGER_MAX_BATCH", "1000"))
+
+# Scheduling (see webapp.broker): seconds of predicted run time a queued job
+# gains per second of waiting. 0 = shortest job first, large = FIFO.
+SCHED_AGING = float(os.environ.get("VOICELOGGER_SCHED_AGING", "1.0"))
+
+# Files a job may write next to the upload; uploads with one of these names are renamed.
+ARTIFACT_NAMES = frozenset({
+    "transcript.txt", "summary.txt", "subtitle.srt", "subtitle.vtt", "segments.json",
+    "report.md", "routing.json", "audio.enc", "audio.enc.meta.json",
+})
+
+
+def runtime_key(payload: Dict[str, Any]) -> str:
+    """Key under which the run time of jobs like ``payload`` is averaged, e.g. ``"medium+diarize"``."""
+    key = payload["model"]
+    if payload.get("route"):
+        key += "+route"
+    if payload.get("diarize"):
+        key += "+diarize"
+    return key
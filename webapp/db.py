@@ -0,0 +1,43 @@
+"""Small SQLite helper shared by the job broker and the blob store index."""
+from __future__ import annotations
+import sqlite3, threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+
+class SQLiteDB:
+    """One connection per thread, autocommit by default, ``tx()`` for write transactions.
+
+    WAL mode is used by default; on network filesystems without shared-memory
+    support pass ``journal_mode="DELETE"``.
+    """
+
+    def __init__(self, path: str | Path, journal_mode: str = "WAL"):
+        self.path = str(path)
+        self.journal_mode = journal_mode
+        self._local = threading.local()
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def tx(self) -> Iterator[sqlite3.Connection]:
+        """``BEGIN IMMEDIATE`` transaction: concurrent writers queue instead of racing."""
+        conn = self.conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
@@ -1,44 +1,116 @@
 from __future__ import annotations
-from concurrent.futures import ThreadPoolExecutor, Future
-from dataclasses import dataclass, field
-from typing import Dict, Optional
-import uuid, time
-
-@dataclass
-class Job:
-    id: str
-    filename: str
-    status: str = "queued"   # queued | running | done | error
-    message: str = ""
-    result_dir: Optional[str] = None
-    created_at: float = field(default_factory=time.time)
+import threading, time
+from typing import Any, Dict, List, Optional, Tuple
+
+from webapp.broker import UNPREDICTED_SECONDS, Job, JobBroker, make_broker, new_job_id
+from webapp.config import BROKER_URL, DATA_DIR, MAX_ATTEMPTS, SCHED_AGING, runtime_key
+from webapp.storage import BlobStore
+
+# Real-time factors assumed until the workers have reported their own.
+_DEFAULT_RTF = {"tiny": 0.05, "base": 0.08, "small": 0.15, "medium": 0.35, "large-v2": 0.7, "large-v3": 0.7}
+_UNKNOWN_DURATION = 600.0
 
 class JobQueue:
-    def __init__(self, max_workers: int = 2):
-        self.exec = ThreadPoolExecutor(max_workers=max_workers)
-        self.jobs: Dict[str, Job] = {}
-        self.futures: Dict[str, Future] = {}
-
-    def submit(self, fn, *, filename: str, **kwargs) -> Job:
-        job_id = str(uuid.uuid4())
-        job = Job(id=job_id, filename=filename, status="queued")
-        self.jobs[job_id] = job
-
-        def wrapper():
-            job.status = "running"
-            try:
-                outdir = fn(**kwargs)
-                job.result_dir = outdir
-                job.status = "done"
-                job.message = "Completed"
-            except Exception as e:
-                job.status = "error"
-                job.message = str(e)
-
-        self.futures[job_id] = self.exec.submit(wrapper)
+    """Front-end view of the job broker.
+
+    Jobs are only recorded here; they are executed by ``webapp.worker``
+    processes, so the web process stays free for request handling.
+    """
+    def __init__(self, broker: JobBroker, cache_seconds: float = 1.0, factors_seconds: float = 30.0):
+        self.broker = broker
+        # Status pages and API polls share one queue snapshot per ``cache_seconds``.
+        self.cache_seconds = cache_seconds
+        self.factors_seconds = factors_seconds
+        self._lock = threading.Lock()
+        self._factors: Tuple[float, Dict[str, float]] = (0.0, {})
+        self._snapshot: Tuple[float, Any] = (0.0, None)
+
+    def _new_job(self, job_id: Optional[str], filename: str, payload: Dict[str, Any]) -> Job:
+        job = Job(id=job_id or new_job_id(), filename=filename, status="queued")
+        job.duration = payload.get("duration")
+        job.predicted_s = self.predict(payload)
         return job
 
+    def submit(self, payload: Dict[str, Any], *, filename: str, job_id: Optional[str] = None) -> Job:
+        return self.broker.enqueue(self._new_job(job_id, filename, payload), payload)
+
+    def submit_many(self, items: List[Tuple[str, str, Dict[str, Any]]]) -> List[Job]:
+        """Enqueue ``(job_id, filename, payload)`` triples in one broker call."""
+        return self.broker.enqueue_many(
+            [(self._new_job(job_id, filename, payload), payload) for job_id, filename, payload in items]
+        )
+
+    def rtf(self, key: str) -> float:
+        """Real-time factor recorded by the workers for ``key`` (see :func:`webapp.config.runtime_key`)."""
+        with self._lock:
+            fetched, factors = self._factors
+            if time.monotonic() - fetched > self.factors_seconds:
+                factors = self.broker.runtime_factors()
+                self._factors = (time.monotonic(), factors)
+        if key in factors:
+            return factors[key]
+        return _DEFAULT_RTF.get(key.split("+")[0], 0.5)
+
+    def predict(self, payload: Dict[str, Any]) -> float:
+        """Predicted run time in seconds of a job with ``payload``."""
+        return (payload.get("duration") or _UNKNOWN_DURATION) * self.rtf(runtime_key(payload))
+
+    def estimates(self, jobs: List[Job]) -> Dict[str, Dict[str, Any]]:
+        """Queue position and expected finish time of queued and running jobs.
+
+        Running jobs are assumed to finish ``predicted_s`` after they started.
+        Jobs a worker has claimed but not started yet (prefetched) follow the
+        job that worker is running. A queued job starts once the work claimed
+        ahead of it (everything running plus the queued jobs ranked before it)
+        has been spread over the workers currently busy.
+
+        Returns:
+            ``{job_id: {"position": int | None, "eta": epoch seconds, "eta_seconds": float}}``
+            for the jobs that are queued or running.
+        """
+        if not any(j.status in ("queued", "running") for j in jobs):
+            return {}
+        with self._lock:
+            taken, snapshot = self._snapshot
+            if snapshot is None or time.monotonic() - taken > self.cache_seconds:
+                snapshot = self.broker.queue_snapshot()
+                self._snapshot = (time.monotonic(), snapshot)
+        queued, running = snapshot
+        now = time.time()
+
+        def predicted(job: Job) -> float:
+            return job.predicted_s if job.predicted_s is not None else UNPREDICTED_SECONDS
+
+        finish: Dict[str, Tuple[Optional[int], float]] = {}
+        free: Dict[Optional[str], float] = {}  # when each busy worker runs out of claimed work
+        for job in running:
+            if job.started_at is not None:
+                free[job.worker_id] = max(now, job.started_at + predicted(job))
+                finish[job.id] = (None, free[job.worker_id])
+        for job in running:
+            if job.started_at is None:
+                free[job.worker_id] = free.get(job.worker_id, now) + predicted(job)
+                finish[job.id] = (None, free[job.worker_id])
+        backlog = sum(end - now for end in free.values())
+        workers = max(1, len(free))
+        for position, job in enumerate(queued, start=1):
+            finish[job.id] = (position, now + backlog / workers + predicted(job))
+            backlog += predicted(job)
+        out: Dict[str, Dict[str, Any]] = {}
+        for job in jobs:
+            if job.id in finish:
+                position, eta = finish[job.id]
+                out[job.id] = {"position": position, "eta": round(eta, 1), "eta_seconds": round(eta - now, 1)}
+        return out
+
     def get(self, job_id: str) -> Optional[Job]:
-        return self.jobs.get(job_id)
+        return self.broker.get(job_id)
+
+    def get_many(self, job_ids: List[str]) -> List[Job]:
+        return self.broker.get_many(job_ids)
+
+    def list(self, limit: int = 100) -> List[Job]:
+        return self.broker.list_jobs(limit)
 
-queue = JobQueue()
+queue = JobQueue(make_broker(BROKER_URL, max_attempts=MAX_ATTEMPTS, aging=SCHED_AGING))
+store = BlobStore(DATA_DIR)
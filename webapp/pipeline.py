@@ -0,0 +1,149 @@
+"""Job processing run by ``webapp.worker`` processes.
+
+A job payload is plain JSON written by the front end at upload time. It names
+the upload only by its file name in the job's directory, and results are
+reported relative to the data directory, so every process resolves them
+against its own ``VOICELOGGER_DATA_DIR`` (hosts may mount it elsewhere).
+"""
+from __future__ import annotations
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from webapp.storage import BlobStore
+
+from core.stages import Item, Stage
+from core.transcribe import prepare_audio, transcribe_to_segments, segments_to_text
+from core.diarize import SAMPLE_RATE
+from core.media import probe_duration
+from core.routing import route_and_transcribe
+from core.summary import simple_summary
+from core.report import generate_markdown_report
+from core.exporters import export_txt, export_srt, export_vtt, export_json
+
+# Written by the front end at upload time rather than by the job.
+_UPLOAD_NAMES = {"audio.enc", "audio.enc.meta.json"}
+
+def _decode(item: Item, store: BlobStore) -> None:
+    job_id, payload = item["job_id"], item["payload"]
+    in_path = store.job_dir(job_id) / payload["filename"]
+    # Files in the job directory may be hard links to shared blobs: never write
+    # into them. Remove what an earlier, interrupted attempt left behind instead.
+    for p in store.job_dir(job_id).iterdir():
+        if p.name not in _UPLOAD_NAMES and p != in_path:
+            p.unlink()
+    # Routing and diarization work on the waveform; otherwise the backend decides.
+    waveform = bool(payload.get("route") or payload.get("diarize"))
+    item["audio"] = audio = prepare_audio(str(in_path), waveform=waveform)
+    item["duration"] = payload.get("duration") or (
+        probe_duration(str(in_path)) if isinstance(audio, str) else len(audio) / SAMPLE_RATE
+    )
+
+
+def _transcribe(item: Item) -> None:
+    payload = item["payload"]
+    audio = item.pop("audio")  # release the waveform as soon as the model is done with it
+    item["meta"] = {}
+    if payload.get("route"):
+        item["segments"], item["meta"]["routing"] = route_and_transcribe(
+            audio,
+            model_size=payload["model"],
+            language=payload["language"],
+            diarize=payload.get("diarize", False),
+        )
+    else:
+        item["segments"] = transcribe_to_segments(
+            audio,
+            model_size=payload["model"],
+            language=payload["language"],
+            diarize=payload.get("diarize", False),
+        )
+
+
+def _write(item: Item, store: BlobStore) -> None:
+    job_id, payload, segs, meta = item["job_id"], item["payload"], item["segments"], item["meta"]
+    outdir = store.job_dir(job_id)
+    in_path = outdir / payload["filename"]
+    if "routing" in meta:
+        (outdir/"routing.json").write_text(json.dumps(meta["routing"], indent=2), encoding="utf-8")
+    text = segments_to_text(segs)
+    (outdir/"transcript.txt").write_text(text, encoding="utf-8")
+
+    # summary
+    if payload["do_summary"]:
+        summ = simple_summary(text, max_sentences=5)
+        (outdir/"summary.txt").write_text(summ, encoding="utf-8")
+    else:
+        summ = ""
+
+    # exporters
+    if payload["do_txt"]:
+        (outdir/"transcript.txt").write_text(export_txt(segs), encoding="utf-8")  # overwrite with clean text
+    if payload["do_srt"]:
+        (outdir/"subtitle.srt").write_text(export_srt(segs), encoding="utf-8")
+    if payload["do_vtt"]:
+        (outdir/"subtitle.vtt").write_text(export_vtt(segs), encoding="utf-8")
+    if payload["do_json"]:
+        (outdir/"segments.json").write_text(export_json(segs), encoding="utf-8")
+
+    # report
+    report_md = generate_markdown_report(text, summ, payload["filename"])
+    (outdir/"report.md").write_text(report_md, encoding="utf-8")
+
+    # Encryption happens in the front end at upload time (see webapp.app.upload)
+    # so the passphrase is never written to the shared job store. The plaintext
+    # is removed by discard_original() once the job is recorded as done.
+    store.intern_dir(job_id, skip={in_path.name})
+    item["result_dir"] = store.relative(outdir)
+
+
+def discard_original(job_id: str, payload: Dict[str, Any], store: BlobStore) -> None:
+    """Delete the plaintext upload of an encrypted job.
+
+    Call only after the broker accepted the result: until then a retry needs
+    the original.
+    """
+    if payload.get("discard_original"):
+        (store.job_dir(job_id) / payload["filename"]).unlink(missing_ok=True)
+
+
+def job_stages(
+    store: BlobStore, io_workers: int = 2, started: Optional[Callable[[Item], None]] = None
+) -> List[Stage]:
+    """Stages of one job for :class:`core.stages.StageGraph`.
+
+    Items are dictionaries with ``job_id`` and ``payload``; when done they also
+    hold ``result_dir`` (relative to the store root), ``meta`` (the routing decision, when routing is
+    enabled) and the audio ``duration`` in seconds (``None`` if unknown). Decoding and writing run on their own threads, so a worker
+    decodes its next job and writes out its previous one while the model is
+    busy. ``started`` is called with the item when its transcription begins.
+    """
+    def transcribe(item: Item) -> None:
+        if started is not None:
+            started(item)
+        _transcribe(item)
+
+    return [
+        Stage("decode", lambda item: _decode(item, store)),
+        Stage("transcribe", transcribe, after=("decode",)),
+        Stage("write", lambda item: _write(item, store), after=("transcribe",), workers=io_workers, capacity=io_workers),
+    ]
+
+
+def run_job(job_id: str, payload: Dict[str, Any], store: BlobStore) -> Tuple[str, Dict[str, Any]]:
+    """Transcribe the uploaded file described by ``payload`` and write all artifacts.
+
+    Artifacts are written next to the upload in ``store.job_dir(job_id)`` and
+    then interned, so identical outputs (and inputs) are stored only once.
+    Runs the :func:`job_stages` one after another; ``webapp.worker`` runs them
+    pipelined across jobs instead.
+
+    Returns:
+        The directory holding the job's result files, relative to the store
+        root (see :meth:`BlobStore.resolve`), and metadata to store with
+        the job (the routing decision, when routing is enabled).
+    """
+    item: Item = {"job_id": job_id, "payload": payload}
+    for stage in job_stages(store):
+        stage.fn(item)
+    discard_original(job_id, payload, store)
+    return item["result_dir"], item["meta"]
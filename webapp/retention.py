@@ -0,0 +1,177 @@
+"""Retention sweeper for ``web_data``.
+
+Deletes job results older than ``VOICELOGGER_MAX_AGE_DAYS``, evicts the oldest
+finished jobs while the blob store exceeds ``VOICELOGGER_MAX_BYTES``, removes
+blobs nothing links to, abandoned partial uploads and stale ``voicelogger_*``
+temporary directories.
+
+Every pass does a bounded amount of work (a few jobs, one blob prefix
+directory, a slice of a directory listing) and then sleeps, so it never holds
+up request handling. Usage totals come from the store index rather than
+directory scans. Runs as a daemon thread in the web front end, or standalone::
+
+    python -m webapp.retention --once
+"""
+from __future__ import annotations
+import argparse, logging, os, shutil, tempfile, threading, time
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+from webapp.broker import JobBroker
+from webapp.storage import BlobStore
+
+log = logging.getLogger("voicelogger.retention")
+
+DAY = 86400.0
+
+
+class RetentionSweeper(threading.Thread):
+    def __init__(
+        self,
+        store: BlobStore,
+        broker: JobBroker,
+        max_age_days: float = 30.0,
+        max_bytes: int = 0,
+        temp_max_age_hours: float = 24.0,
+        interval: float = 60.0,
+        batch: int = 20,
+        min_keep_seconds: float = 3600.0,
+    ):
+        super().__init__(daemon=True, name="retention-sweeper")
+        self.store, self.broker = store, broker
+        self.max_age = max_age_days * DAY if max_age_days > 0 else None
+        self.max_bytes = max_bytes
+        self.temp_max_age = temp_max_age_hours * 3600.0
+        self.interval = interval
+        self.batch = batch
+        # Quota eviction never touches younger jobs: their blobs are still in the
+        # store's grace period, so deleting them would free nothing yet.
+        self.min_keep = min_keep_seconds
+        self._stopped = threading.Event()
+        self._prefix = 0
+        self._scans: Dict[str, Iterator[os.DirEntry]] = {}
+        self._cursors: Dict[str, Optional[Tuple[str, float]]] = {}
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self.sweep_once()
+            except Exception:
+                log.exception("retention sweep failed")
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def sweep_once(self) -> Dict[str, int]:
+        """Run one bounded pass of every retention rule; return what was removed."""
+        stats = {"expired": 0, "evicted": 0, "bytes_freed": 0, "orphans": 0, "stale_dirs": 0}
+        now = time.time()
+        if self.max_age:
+            for job_id in self._candidates("age", before=now - self.max_age):
+                freed = self._drop_job(job_id, "Results deleted after retention period")
+                if freed is not None:
+                    stats["expired"] += 1
+                    stats["bytes_freed"] += freed
+        if self.max_bytes:
+            for job_id in self._candidates("quota", before=now - self.min_keep):
+                if self.store.total_bytes() <= self.max_bytes:
+                    break
+                freed = self._drop_job(job_id, "Results deleted to stay within the storage quota")
+                if freed is not None:
+                    stats["evicted"] += 1
+                    stats["bytes_freed"] += freed
+        # One of the 256 blob prefix directories per pass.
+        freed = self.store.sweep_blob_prefix(f"{self._prefix:02x}")
+        self._prefix = (self._prefix + 1) % 256
+        stats["bytes_freed"] += freed
+        stats["orphans"] += int(freed > 0)
+        stats["stale_dirs"] += self._sweep_dir(
+            self.store.incoming_dir, lambda e: e.name.endswith(".part"), max_age=DAY
+        )
+        stats["stale_dirs"] += self._sweep_dir(
+            Path(tempfile.gettempdir()), lambda e: e.name.startswith("voicelogger_"), max_age=self.temp_max_age
+        )
+        if any(stats.values()):
+            log.info("retention: %s", stats)
+        return stats
+
+    def _candidates(self, rule: str, before: float) -> Iterator[str]:
+        """The next ``batch`` jobs created before ``before``, oldest first.
+
+        Each rule resumes behind the last job it looked at, so jobs that cannot
+        be dropped yet (still queued or running) do not hold up the ones behind
+        them; the listing starts over once it reaches the end.
+        """
+        rows = self.store.oldest_jobs(self.batch, before=before, after=self._cursors.get(rule))
+        for row in rows:
+            self._cursors[rule] = row
+            yield row[0]
+        if len(rows) < self.batch:
+            self._cursors[rule] = None
+
+    def _drop_job(self, job_id: str, reason: str) -> Optional[int]:
+        job = self.broker.get(job_id)
+        if job is not None and not self.broker.expire(job_id, reason):
+            return None  # still queued or running
+        return self.store.delete_job(job_id)
+
+    def _sweep_dir(self, directory: Path, match, max_age: float) -> int:
+        """Examine the next ``batch`` entries of ``directory``, resuming where the last pass stopped."""
+        key = str(directory)
+        removed = 0
+        for _ in range(self.batch):
+            it = self._scans.get(key)
+            if it is None:
+                try:
+                    it = self._scans[key] = os.scandir(directory)
+                except FileNotFoundError:
+                    return removed
+            entry = next(it, None)
+            if entry is None:
+                it.close()
+                del self._scans[key]  # restart the listing on the next pass
+                break
+            try:
+                if not match(entry) or time.time() - entry.stat(follow_symlinks=False).st_mtime < max_age:
+                    continue
+                if self.store.root.resolve().is_relative_to(Path(entry.path).resolve()):
+                    continue  # the data directory itself may live in the temp dir
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.unlink(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+def build_parser() -> argparse.ArgumentParser:
+    from webapp.config import MAX_AGE_DAYS, MAX_BYTES, TEMP_MAX_AGE_HOURS
+
+    parser = argparse.ArgumentParser(description="Apply Voicelogger retention rules to web_data.")
+    parser.add_argument("--max-age-days", type=float, default=MAX_AGE_DAYS, help="Delete results older than this (0 = keep)")
+    parser.add_argument("--max-bytes", type=int, default=MAX_BYTES, help="Evict oldest results above this many bytes (0 = no quota)")
+    parser.add_argument("--temp-max-age-hours", type=float, default=TEMP_MAX_AGE_HOURS, help="Remove voicelogger_* temp dirs older than this")
+    parser.add_argument("--once", action="store_true", help="Sweep until nothing is left to do, then exit")
+    return parser
+
+
+def main(argv=None) -> None:
+    from webapp.jobs import queue, store
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    args = build_parser().parse_args(argv)
+    sweeper = RetentionSweeper(
+        store, queue.broker, args.max_age_days, args.max_bytes, args.temp_max_age_hours, batch=200
+    )
+    if not args.once:
+        sweeper.interval = 5.0
+        sweeper.run()
+        return
+    for _ in range(256):  # enough passes to visit every blob prefix
+        sweeper.sweep_once()
+
+
+if __name__ == "__main__":
+    main()
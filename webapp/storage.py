@@ -0,0 +1,215 @@
+"""Content-addressed storage for uploads and job artifacts.
+
+Layout under ``DATA_DIR``::
+
+    blobs/ab/abcdef...   file contents, named by SHA-256
+    jobs/<job id>/       hard links to blobs, one directory per job
+    incoming/            partial uploads while they are being hashed
+    store.db             index of blob sizes and which job references which blob
+
+Identical uploads and artifacts are stored once and hard-linked into every
+job directory that uses them. A blob whose link count drops to one is no
+longer referenced and can be deleted. Files in ``jobs/`` are shared with the
+blob store, so they must never be modified in place: write new files and
+intern them with :meth:`BlobStore.intern_dir`.
+"""
+from __future__ import annotations
+import errno, hashlib, os, shutil, time, uuid
+from pathlib import Path
+from typing import BinaryIO, Iterable, List, Optional, Tuple
+
+from webapp.db import SQLiteDB
+
+_CHUNK = 1 << 20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at);
+CREATE TABLE IF NOT EXISTS job_blobs (
+    job_id TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (job_id, digest)
+);
+"""
+
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+        shutil.copy2(src, dst)  # filesystem without hard links: fall back to a copy
+
+
+class BlobStore:
+    """SHA-256 addressed blobs plus per-job directories of hard links to them."""
+
+    def __init__(self, root: Path, journal_mode: str = "WAL"):
+        self.root = Path(root)
+        self.blobs_dir = self.root / "blobs"
+        self.jobs_dir = self.root / "jobs"
+        self.incoming_dir = self.root / "incoming"
+        for d in (self.blobs_dir, self.jobs_dir, self.incoming_dir):
+            d.mkdir(parents=True, exist_ok=True)
+        self.db = SQLiteDB(self.root / "store.db", journal_mode)
+        self.db.conn().executescript(_SCHEMA)
+
+    # ---- blobs ----
+    def blob_path(self, digest: str) -> Path:
+        return self.blobs_dir / digest[:2] / digest
+
+    def _adopt(self, path: Path, digest: str, size: int) -> Path:
+        """Make ``path`` (already hashed) the blob for ``digest``, or drop it if the blob exists."""
+        blob = self.blob_path(digest)
+        blob.parent.mkdir(exist_ok=True)
+        with self.db.tx() as conn:
+            if blob.exists():
+                os.utime(blob)  # fresh mtime protects it from the orphan sweep until it is linked
+                path.unlink()
+            else:
+                os.replace(path, blob)
+                os.chmod(blob, 0o444)
+                conn.execute(
+                    "INSERT OR REPLACE INTO blobs (digest, size, created_at) VALUES (?, ?, ?)",
+                    (digest, size, time.time()),
+                )
+        return blob
+
+    def ingest_stream(self, src: BinaryIO) -> str:
+        """Copy ``src`` into the store while hashing it; return the digest."""
+        tmp = self.incoming_dir / f"{uuid.uuid4().hex}.part"
+        h, size = hashlib.sha256(), 0
+        with open(tmp, "wb") as f:
+            while chunk := src.read(_CHUNK):
+                h.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        digest = h.hexdigest()
+        self._adopt(tmp, digest, size)
+        return digest
+
+    def link(self, digest: str, dst: Path) -> Path:
+        """Hard-link blob ``digest`` to ``dst``."""
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        _link_or_copy(self.blob_path(digest), dst)
+        return dst
+
+    def intern(self, path: Path) -> Tuple[str, int]:
+        """Move a freshly written file into the store, leaving a hard link at ``path``."""
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(_CHUNK):
+                h.update(chunk)
+        digest, size = h.hexdigest(), path.stat().st_size
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}")
+        os.replace(path, tmp)
+        _link_or_copy(self._adopt(tmp, digest, size), path)
+        return digest, size
+
+    # ---- jobs ----
+    def job_dir(self, job_id: str) -> Path:
+        return self.jobs_dir / job_id
+
+    def relative(self, path: Path) -> str:
+        """``path`` relative to the store root, for storing in the shared job broker.
+
+        Each host may mount the data directory elsewhere, so only relative
+        paths are exchanged between processes; see :meth:`resolve`.
+        """
+        return Path(path).relative_to(self.root).as_posix()
+
+    def resolve(self, path: str) -> Path:
+        """Local path of a path returned by :meth:`relative`."""
+        return self.root / path
+
+    def record(self, job_id: str, digests: Iterable[str], created_at: Optional[float] = None) -> None:
+        """Register which blobs ``job_id`` references (used by retention)."""
+        with self.db.tx() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO jobs (job_id, created_at) VALUES (?, ?)",
+                (job_id, created_at or time.time()),
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO job_blobs (job_id, digest) VALUES (?, ?)",
+                [(job_id, d) for d in digests],
+            )
+
+    def intern_dir(self, job_id: str, skip: Iterable[str] = ()) -> List[str]:
+        """Intern every regular file of a job directory that is not yet a blob link."""
+        skip = set(skip)
+        digests: List[str] = []
+        for entry in os.scandir(self.job_dir(job_id)):
+            if entry.name in skip or entry.name.startswith(".") or not entry.is_file(follow_symlinks=False):
+                continue
+            if entry.stat(follow_symlinks=False).st_nlink == 1:
+                digest, _ = self.intern(Path(entry.path))
+                digests.append(digest)
+        self.record(job_id, digests)
+        return digests
+
+    def delete_job(self, job_id: str) -> int:
+        """Remove a job directory and every blob only it referenced; return bytes freed."""
+        shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+        conn = self.db.conn()
+        digests = [r["digest"] for r in conn.execute("SELECT digest FROM job_blobs WHERE job_id = ?", (job_id,))]
+        # A short grace period keeps blobs that another upload is deduplicating
+        # into right now; anything it spares is collected by the orphan sweep.
+        freed = sum(self.release_if_unreferenced(d, grace=60.0) for d in digests)
+        with self.db.tx() as conn:
+            conn.execute("DELETE FROM job_blobs WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        return freed
+
+    def release_if_unreferenced(self, digest: str, grace: float = 3600.0) -> int:
+        """Delete a blob nobody links to any more; return its size (0 if kept)."""
+        blob = self.blob_path(digest)
+        with self.db.tx() as conn:
+            try:
+                st = blob.stat()
+            except FileNotFoundError:
+                conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+                return 0
+            if st.st_nlink > 1 or time.time() - st.st_mtime < grace:
+                return 0
+            blob.unlink()
+            conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+        return st.st_size
+
+    def sweep_blob_prefix(self, prefix: str, grace: float = 3600.0) -> int:
+        """Release unreferenced blobs in one ``blobs/<prefix>`` directory; return bytes freed."""
+        try:
+            entries = [e.name for e in os.scandir(self.blobs_dir / prefix)]
+        except FileNotFoundError:
+            return 0
+        return sum(self.release_if_unreferenced(name, grace) for name in entries)
+
+    def total_bytes(self) -> int:
+        return int(self.db.conn().execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0])
+
+    def oldest_jobs(
+        self, limit: int, before: Optional[float] = None, after: Optional[Tuple[str, float]] = None
+    ) -> List[Tuple[str, float]]:
+        """Up to ``limit`` ``(job_id, created_at)`` pairs, oldest first.
+
+        ``before`` excludes jobs created at or after that time; ``after`` (a
+        pair returned earlier) resumes the listing behind that job.
+        """
+        where, args = [], []
+        if before is not None:
+            where.append("created_at < ?")
+            args.append(before)
+        if after is not None:
+            where.append("(created_at, job_id) > (?, ?)")
+            args += [after[1], after[0]]
+        sql = "SELECT job_id, created_at FROM jobs" + (" WHERE " + " AND ".join(where) if where else "")
+        rows = self.db.conn().execute(sql + " ORDER BY created_at, job_id LIMIT ?", (*args, limit)).fetchall()
+        return [(r["job_id"], r["created_at"]) for r in rows]
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""Worker process for the Voicelogger web service.
+
+Claims jobs from the shared broker, keeps their leases alive with a heartbeat
+thread while transcribing, and reports the outcome. Start as many of these as
+the host (or hosts sharing ``VOICELOGGER_DATA_DIR``) can handle::
+
+    python -m webapp.worker --processes 4
+"""
+from __future__ import annotations
+import argparse, logging, multiprocessing, os, signal, socket, threading, traceback
+from typing import List, Optional
+
+from webapp.broker import JobBroker, make_broker
+from webapp.config import BROKER_URL, DATA_DIR, LEASE_SECONDS, MAX_ATTEMPTS, POLL_INTERVAL, SCHED_AGING, runtime_key
+from webapp.storage import BlobStore
+
+log = logging.getLogger("voicelogger.worker")
+
+
+class _Heartbeat(threading.Thread):
+    """Renews a job lease every third of the lease period until stopped."""
+
+    def __init__(self, broker: JobBroker, job_id: str, worker_id: str, lease_seconds: float):
+        super().__init__(daemon=True, name=f"heartbeat-{job_id[:8]}")
+        self.broker, self.job_id, self.worker_id = broker, job_id, worker_id
+        self.lease_seconds = lease_seconds
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.lease_seconds / 3):
+            try:
+                if not self.broker.heartbeat(self.job_id, self.worker_id, self.lease_seconds):
+                    log.warning("lost lease on job %s; its result will be discarded", self.job_id)
+                    return
+            except Exception:
+                log.exception("heartbeat for job %s failed", self.job_id)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+
+def run_worker(
+    broker: JobBroker,
+    worker_id: str,
+    lease_seconds: float = LEASE_SECONDS,
+    poll_interval: float = POLL_INTERVAL,
+    stop: Optional[threading.Event] = None,
+    burst: bool = False,
+    store: Optional[BlobStore] = None,
+    prefetch: int = 0,
+    io_workers: int = 2,
+) -> int:
+    """Process jobs until ``stop`` is set (or the queue is empty when ``burst``).
+
+    Jobs run through the stages of :func:`webapp.pipeline.job_stages`: up to
+    ``prefetch`` further jobs are claimed and decoded while the current one is
+    transcribed, and finished jobs are written out concurrently. A prefetched
+    job stays with this worker even if another one becomes idle first, so
+    prefetching is off by default.
+
+    Returns:
+        The number of jobs this worker handled.
+    """
+    # heavy imports stay out of the parent process
+    from core.stages import StageGraph
+    from webapp.pipeline import discard_original, job_stages
+
+    stop = stop or threading.Event()
+    store = store or BlobStore(DATA_DIR)
+
+    def claims():
+        while not stop.is_set():
+            claimed = broker.claim(worker_id, lease_seconds)
+            if claimed is None:
+                if burst:
+                    return
+                stop.wait(poll_interval)
+                continue
+            job, payload = claimed
+            log.info("%s: running job %s (%s, attempt %d)", worker_id, job.id, job.filename, job.attempts)
+            hb = _Heartbeat(broker, job.id, worker_id, lease_seconds)
+            hb.start()
+            yield {"job_id": job.id, "payload": payload, "heartbeat": hb}
+
+    handled = 0
+    # A job counts against prefetch until it is transcribed; writing it out
+    # overlaps with the next jobs.
+    graph = StageGraph(
+        job_stages(store, io_workers=io_workers, started=lambda item: broker.start(item["job_id"], worker_id)),
+        max_in_flight=1 + prefetch, release_after="transcribe",
+    )
+    for item in graph.run(claims()):
+        item["heartbeat"].stop()
+        if "error" in item:
+            e = item["error"]
+            log.error(
+                "%s: job %s failed in %s\n%s", worker_id, item["job_id"], item["error_stage"],
+                "".join(traceback.format_exception(type(e), e, e.__traceback__)),
+            )
+            broker.fail(item["job_id"], worker_id, str(e))
+        else:
+            if broker.complete(item["job_id"], worker_id, item["result_dir"], meta=item["meta"]):
+                discard_original(item["job_id"], item["payload"], store)
+            # Time actually spent on the job, not time spent waiting between stages.
+            busy = sum(item["timings"].values())
+            if (item.get("duration") or 0) >= 1.0:
+                broker.record_runtime(socket.gethostname(), runtime_key(item["payload"]), item["duration"], busy)
+        handled += 1
+    return handled
+
+
+def _worker_main(
+    url: str, worker_id: str, lease_seconds: float, poll_interval: float, burst: bool, prefetch: int
+) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    stop = threading.Event()
+    # Finish the current job on SIGTERM/SIGINT instead of abandoning its lease.
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    broker = make_broker(url, max_attempts=MAX_ATTEMPTS, aging=SCHED_AGING)
+    try:
+        run_worker(broker, worker_id, lease_seconds, poll_interval, stop=stop, burst=burst, prefetch=prefetch)
+    finally:
+        # multiprocessing children skip atexit, so stop backend helper processes here.
+        from core.transcribe import close_backends
+        close_backends()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Run Voicelogger transcription workers.")
+    parser.add_argument("--broker", default=BROKER_URL, help=f"Job broker URL (default: {BROKER_URL})")
+    parser.add_argument("--processes", type=int, default=1, help="Number of worker processes to start (default: 1)")
+    parser.add_argument("--lease", type=float, default=LEASE_SECONDS, help="Lease length in seconds")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL, help="Idle poll interval in seconds")
+    parser.add_argument("--burst", action="store_true", help="Exit once the queue is empty")
+    parser.add_argument(
+        "--prefetch", type=int, default=0,
+        help="Jobs to claim and decode ahead of the one being transcribed (default: 0). A prefetched "
+        "job stays with this worker even if another one becomes idle first",
+    )
+    return parser
+
+
+def main(argv: List[str] | None = None) -> None:
+    args = build_parser().parse_args(argv)
+    prefix = f"{socket.gethostname()}-{os.getpid()}"
+    if args.processes <= 1:
+        _worker_main(args.broker, prefix, args.lease, args.poll_interval, args.burst, args.prefetch)
+        return
+    procs = [
+        multiprocessing.Process(
+            target=_worker_main,
+            args=(args.broker, f"{prefix}-{i}", args.lease, args.poll_interval, args.burst, args.prefetch),
+            name=f"voicelogger-worker-{i}",
+        )
+        for i in range(args.processes)
+    ]
+    for p in procs:
+        p.start()
+    # Children handle SIGINT themselves; forward SIGTERM and wait for them.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: [p.terminate() for p in procs])
+    for p in procs:
+        p.join()
+
+
+if __name__ == "__main__":
+    main()